@@ -0,0 +1,162 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import networkx as nx
+import synthetic_data as sd
+from preprocessing_steps import (group_pre_post, batched_deficit_percentage, batched_regression_residuals,
+                                 regression_residuals)
+import correlation_engine as ce
+import network_centrality as nc
+import Multilayers_Plots as mp
+import Interactive_Networks as inet
+import data_catalog as dc
+
+# Every stage timed by the suite, in pipeline order
+STAGES = ["grouping", "deficits", "regression", "regression_batched", "spearman", "spearman_missing", "edge_extraction",
+          "centrality", "render_multilayers", "render_interactive"]
+
+# Threshold of the graphs built by the suite
+BENCHMARK_TRESHOLD = 0.175
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+# Run a stage repeats times, returns its result and the seconds of every run
+def time_stage(run, repeats=1):
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run()
+        seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+# Versions and machine the results were measured on
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "networkx": nx.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count()
+    }
+
+# Time every selected stage on synthetic data of n_patients x n_variables. Each stage runs on the
+# output of the previous one, like the pipeline: preprocessing on every test file, then the network
+# stages on the 3-layer matrix of the first hemisphere and imputation.
+def run_suite(n_patients, n_variables, stages=STAGES, engines=ce.ENGINES, repeats=1, seed=0):
+    results = {}
+
+    def record(stage, seconds, **details):
+        results[stage] = {"seconds": min(seconds), "runs": seconds, **details}
+        print(f"{stage:24s}{min(seconds):10.3f}s  {details if details else ''}")
+
+    imputations = sd.imputation_frames(n_patients, seed)
+    grouped, seconds = time_stage(lambda: [(group_pre_post(df_Pre, df_Post_3M, test), test, hemi)
+                                           for (test, hemi, _), (df_Pre, df_Post_3M) in imputations.items()], repeats)
+    if "grouping" in stages:
+        record("grouping", seconds, files=len(grouped))
+
+    deficits, seconds = time_stage(lambda: batched_deficit_percentage([(df, test) for df, test, _ in grouped]), repeats)
+    if "deficits" in stages:
+        record("deficits", seconds, files=len(deficits))
+
+    targets = [(df, test, hemi) for df, (_, test, hemi) in zip(deficits, grouped)]
+    if "regression" in stages:
+        _, seconds = time_stage(lambda: [regression_residuals(*target) for target in targets], repeats)
+        record("regression", seconds, files=len(targets))
+    if "regression_batched" in stages:
+        _, seconds = time_stage(lambda: batched_regression_residuals(targets), repeats)
+        record("regression_batched", seconds, files=len(targets))
+
+    df = sd.network_frames(sd.hemisphere[0], n_patients, n_variables, seed)[("DECO_TESTS_DAMAGE", sd.imp[0])]
+    matrix_corr = None
+    for engine in (engines if "spearman" in stages else []):
+        matrix_corr, seconds = time_stage(lambda: ce.spearman_corr(df, engine), repeats)
+        record(f"spearman_{engine}", seconds, shape=list(df.shape))
+    if matrix_corr is None:
+        matrix_corr = ce.spearman_corr(df)
+
+    # Pairwise-complete matrices of the same data with missing values in the deco and damage columns
+    df_missing = sd.with_missing_values(df, seed)
+    for engine in (engines if "spearman_missing" in stages else []):
+        _, seconds = time_stage(lambda: ce.spearman_corr(df_missing, engine), repeats)
+        record(f"spearman_missing_{engine}", seconds, shape=list(df.shape),
+               missing=int(df_missing.isna().to_numpy().sum()))
+
+    G, seconds = time_stage(lambda: mp.build_graph(matrix_corr, BENCHMARK_TRESHOLD), repeats)
+    if "edge_extraction" in stages:
+        record("edge_extraction", seconds, nodes=G.number_of_nodes(), edges=G.number_of_edges())
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        # The renderers cache their node layouts under the data root: keep them in the temporary directory
+        dc.start([], output_dir)
+        # Centralities and the interactive plot use the positive-edge graph, like Interactive_Networks
+        G_interactive = inet.build_graph(matrix_corr, BENCHMARK_TRESHOLD)
+        if "centrality" in stages:
+            _, seconds = time_stage(lambda: nc.compute_centralities(G_interactive), repeats)
+            record("centrality", seconds, nodes=G_interactive.number_of_nodes(), edges=G_interactive.number_of_edges())
+
+        if "render_multilayers" in stages:
+            def render_multilayers():
+                template = mp.create_template(G, [1, 2, 3])
+                mp.draw_edges(template, G)
+                template["fig"].savefig(os.path.join(output_dir, "plot.png"), dpi=300, bbox_inches='tight')
+                template["legend_fig"].savefig(os.path.join(output_dir, "legend.png"), dpi=300, bbox_inches='tight')
+                mp.close_template(template)
+            mp.plt.switch_backend("Agg")
+            _, seconds = time_stage(render_multilayers, repeats)
+            record("render_multilayers", seconds)
+
+        if "render_interactive" in stages:
+            _, seconds = time_stage(lambda: inet.write_html(G_interactive, inet.NET_OPTIONS, os.path.join(output_dir, "plot.html")), repeats)
+            record("render_interactive", seconds, edges=G_interactive.number_of_edges())
+    return results
+
+# Print the ratio of every stage to the same stage of a previous results file
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)["stages"]
+    print(f"\nCompared with {baseline_path}:")
+    for stage, result in results.items():
+        if stage in baseline:
+            ratio = result["seconds"] / baseline[stage]["seconds"] if baseline[stage]["seconds"] else float("nan")
+            print(f"{stage:24s}{baseline[stage]['seconds']:10.3f}s -> {result['seconds']:10.3f}s  x{ratio:.2f}")
+
+# Time the pipeline stages on synthetic data and save the results as JSON
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument("--size", choices=list(sd.SIZES), default="small", help="Preset (patients x variables)")
+    parser.add_argument("--patients", type=int, default=None, help="Number of patients, overrides --size")
+    parser.add_argument("--variables", type=int, default=None, help="Variables of the 3-layer network, overrides --size")
+    parser.add_argument("--stages", nargs='+', choices=STAGES, default=STAGES, help="Stages to time")
+    parser.add_argument("--engines", nargs='+', choices=ce.ENGINES, default=ce.ENGINES, help="Spearman engines to time")
+    parser.add_argument("--repeats", type=int, default=1, help="Runs of every stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    parser.add_argument("--output", default=None, help="Results file (default: results/benchmark_<size>_<time>.json)")
+    parser.add_argument("--compare", default=None, help="Previous results file to compare with")
+    args = parser.parse_args()
+
+    n_patients, n_variables = sd.SIZES[args.size]
+    n_patients = args.patients or n_patients
+    n_variables = args.variables or n_variables
+    print(f"Benchmark on {n_patients} patients x {n_variables} variables")
+    results = run_suite(n_patients, n_variables, args.stages, args.engines, args.repeats, args.seed)
+
+    created = datetime.datetime.now()
+    output_path = args.output or os.path.join(RESULTS_DIR, f"benchmark_{n_patients}x{n_variables}_{created:%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"created": created.isoformat(timespec='seconds'), "patients": n_patients, "variables": n_variables,
+                   "seed": args.seed, "repeats": args.repeats, "environment": environment(), "stages": results}, f, indent=1)
+    print(f"Results saved in {output_path}")
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,159 @@
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+# The pipeline modules live in the parent directory and in Preprocessing_data
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "Preprocessing_data"))
+import network_manipulation as nm
+import data_catalog as dc
+from preprocessing_steps import test_name, hemisphere, imp
+
+# Dataset sizes (patients, variables of the 3-layer network), from the real cohort to the largest target
+SIZES = {
+    "small": (126, 50),
+    "medium": (1000, 500),
+    "large": (10000, 5000)
+}
+
+# Node name prefixes of the subcortical (deco) and cortical (damage) layers, tests are named {test}_{hemi}
+DECO_PREFIX = "D_Tract_"
+DAMAGE_PREFIX = "G_Region_"
+
+# Share of the scores re-drawn in each imputation, like the imputed missing values
+IMPUTED_SHARE = 0.1
+
+# Largest share of missing patients of a deco or damage column, like the *_filtered_80 source files,
+# and number of consecutive columns missing the same patients
+MISSING_SHARE = 0.2
+MISSING_BLOCK = 10
+
+
+# Number of test, deco and damage variables of a 3-layer network of n_variables nodes
+def variable_counts(n_variables):
+    n_tests = len(test_name)
+    if n_variables < n_tests + 2:
+        raise ValueError(f"At least {n_tests + 2} variables are needed: {n_tests} tests, one deco and one damage")
+    n_deco = (n_variables - n_tests) // 2
+    return n_tests, n_deco, n_variables - n_tests - n_deco
+
+# Node names of the three layers of a hemisphere
+def node_names(hemi, n_deco, n_damage):
+    tests = [f"{test}_{hemi}" for test in test_name]
+    deco = [f"{DECO_PREFIX}{index + 1}_{hemi}" for index in range(n_deco)]
+    damage = [f"{DAMAGE_PREFIX}{index + 1}_{hemi}" for index in range(n_damage)]
+    return tests, deco, damage
+
+# Print how many generated names network_manipulation.get_layer puts in another layer than expected
+def check_layers(names, layer):
+    wrong = [name for name in names if nm.get_layer(name) != layer]
+    if wrong:
+        print(f"Warning: {len(wrong)} names expected in layer {layer} are not recognized as such, e.g. {wrong[0]}")
+
+# Correlated standard normal data: a few shared factors plus noise, so that the networks have edges
+def latent_data(rng, n_patients, n_columns, n_factors=5):
+    factors = rng.standard_normal((n_patients, n_factors))
+    loadings = rng.standard_normal((n_factors, n_columns)) * 0.5
+    return factors @ loadings + rng.standard_normal((n_patients, n_columns))
+
+# Re-draw a share of the rows of every column, like a new imputation of the missing values
+def impute(rng, values, scale=1.0):
+    values = values.copy()
+    mask = rng.random(values.shape) < IMPUTED_SHARE
+    values[mask] += rng.standard_normal(mask.sum()) * scale
+    return values
+
+# Copy of a network frame with missing values in its deco and damage columns: each block of MISSING_BLOCK
+# columns misses the same patients, up to MISSING_SHARE of them
+def with_missing_values(df, seed=0):
+    rng = np.random.default_rng([seed, len(df.columns)])
+    df = df.copy()
+    columns = [column for column in df.columns if column.startswith((DECO_PREFIX, DAMAGE_PREFIX))]
+    for start in range(0, len(columns), MISSING_BLOCK):
+        missing = rng.random(len(df)) < rng.uniform(0, MISSING_SHARE)
+        df.loc[missing, columns[start:start + MISSING_BLOCK]] = np.nan
+    return df
+
+# Imputed Pre and Post_3M files of every test, hemisphere and imputation:
+# {(test, hemi, i): (df_Pre, df_Post_3M)} with the ID;AGE;NSE;{test}_Pre / {test}_Post_3M schema
+def imputation_frames(n_patients, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(n_patients)
+    age = rng.integers(20, 90, n_patients)
+    nse = rng.integers(1, 4, n_patients)
+    frames = {}
+    for hemi in hemisphere:
+        pre_scores = 50 + 10 * latent_data(rng, n_patients, len(test_name))
+        decline = 0.2 * latent_data(rng, n_patients, len(test_name))
+        for i in imp:
+            pre = np.round(np.abs(impute(rng, pre_scores, 10)) + 1, 2)
+            post = np.round(np.abs(pre * (1 - impute(rng, decline, 0.2))), 2)
+            for column, test in enumerate(test_name):
+                df_Pre = pd.DataFrame({"ID": ids, "AGE": age, "NSE": nse, f"{test}_Pre": pre[:, column]})
+                df_Post_3M = pd.DataFrame({"ID": ids, "AGE": age, "NSE": nse, f"{test}_Post_3M": post[:, column]})
+                frames[(test, hemi, i)] = (df_Pre, df_Post_3M)
+    return frames
+
+# Source frames of the correlation networks of one hemisphere: {(folder, i): df}, i is None for
+# the files that do not depend on the imputation. Every file has the same rows, like the real ones.
+def network_frames(hemi, n_patients, n_variables, seed=0):
+    rng = np.random.default_rng([seed, hemisphere.index(hemi)])
+    _, n_deco, n_damage = variable_counts(n_variables)
+    tests, deco, damage = node_names(hemi, n_deco, n_damage)
+    latent = latent_data(rng, n_patients, n_variables)
+
+    # Deco and damage: percentages, many damage values at 0
+    df_deco = pd.DataFrame(np.round(100 / (1 + np.exp(-latent[:, len(tests):len(tests) + n_deco])), 3), columns=deco)
+    damage_values = np.clip(latent[:, len(tests) + n_deco:] * 20, 0, 100)
+    df_damage = pd.DataFrame(np.round(damage_values, 3), columns=damage)
+
+    frames = {("DECO", None): df_deco, ("DAMAGE", None): df_damage,
+              ("DECO_AND_DAMAGE", None): pd.concat([df_deco, df_damage], axis=1)}
+    for i in imp:
+        # Tests: normalized residuals of step 4, one set per imputation
+        test_values = impute(rng, latent[:, :len(tests)])
+        df_tests = pd.DataFrame(np.round((test_values - test_values.mean(axis=0)) / test_values.std(axis=0), 6), columns=tests)
+        frames[("TESTS", i)] = df_tests
+        frames[("DECO_AND_TESTS", i)] = pd.concat([df_tests, df_deco], axis=1)
+        frames[("TESTS_AND_DAMAGE", i)] = pd.concat([df_tests, df_damage], axis=1)
+        frames[("DECO_TESTS_DAMAGE", i)] = pd.concat([df_tests, df_deco, df_damage], axis=1)
+    return frames
+
+# Write a semicolon CSV, creating its directory
+def write_frame(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, sep=';', index=False)
+
+# Write the whole synthetic data tree under root: the imputed test files of the preprocessing
+# and the source files of every correlation network. One hemisphere is in memory at a time.
+def write_layout(root, n_patients, n_variables, seed=0):
+    catalog = dc.DataCatalog(root)
+    for (test, hemi, i), (df_Pre, df_Post_3M) in imputation_frames(n_patients, seed).items():
+        write_frame(df_Pre, catalog.path("imputation_pre", hemi=hemi, imp=i, test=test))
+        write_frame(df_Post_3M, catalog.path("imputation_post", hemi=hemi, imp=i, test=test))
+
+    for hemi in hemisphere:
+        frames = network_frames(hemi, n_patients, n_variables, seed)
+        tests, deco, damage = node_names(hemi, *variable_counts(n_variables)[1:])
+        for names, layer in [(tests, 1), (deco, 2), (damage, 3)]:
+            check_layers(names, layer)
+        for (folder, i), df in frames.items():
+            write_frame(df, catalog.path("network_source", folder, hemi, i))
+
+# Write a synthetic data tree with the layout and schema of the real one
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic copy of the data tree.")
+    parser.add_argument("root", help="Directory receiving the Données tree (use it as MAIN_PATH)")
+    parser.add_argument("--size", choices=list(SIZES), default="small", help="Preset (patients x variables)")
+    parser.add_argument("--patients", type=int, default=None, help="Number of patients, overrides --size")
+    parser.add_argument("--variables", type=int, default=None, help="Variables of the 3-layer network, overrides --size")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generator")
+    args = parser.parse_args()
+
+    n_patients, n_variables = SIZES[args.size]
+    n_patients = args.patients or n_patients
+    n_variables = args.variables or n_variables
+    print(f"Writing {n_patients} patients x {n_variables} variables under {args.root}")
+    write_layout(args.root, n_patients, n_variables, args.seed)
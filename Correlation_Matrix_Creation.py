@@ -1,105 +1,497 @@
-import pandas as pd
+import argparse
+import contextlib
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import os
+import correlation_engine as ce
+import edge_extraction as ee
+import matrix_storage as ms
+import build_manifest as bm
+import imputation_pooling as ip
+import permutation_significance as ps
+import run_report as rr
+import data_catalog as dc
+import prefetch_loader as pl
 
-# Function to generate the source and destination file paths based on input parameters
+# Stages of the data catalog read and written by this script
+CATALOG_STAGES = ["network_source", "correlation", "between_variance"]
+
+# Source and destination paths of a job, resolved by the data catalog
 def get_file_path(type_of_network, which_layers, hemi, imp=None):
-    base_source_path = r"D:\These\Données"  # Base directory for the raw data files
-    base_dest_path = r"D:\These\Coding\Correlation_Matrix"  # Base directory for saving correlation matrices
-
-    # Determine the folder based on network type and layers involved
-    if type_of_network == "3_layers":
-        folder = "DECO_TESTS_DAMAGE"
-    elif type_of_network == "2_layers":
-        if which_layers == "deco_and_tests":
-            folder = "DECO_AND_TESTS"
-        elif which_layers == "tests_and_damage":
-            folder = "TESTS_AND_DAMAGE"
-        elif which_layers == "deco_and_damage":
-            folder = "DECO_AND_DAMAGE"
-    elif type_of_network == "one_by_one_layer":
-        if which_layers == "tests":
-            folder = "TESTS"
-        elif which_layers == "deco":
-            folder = "DECO"
-        elif which_layers == "damage":
-            folder = "DAMAGE"
-
-    # Construct source file path based on the folder and naming conventions
-    if folder in ["DECO_AND_TESTS", "DECO_TESTS_DAMAGE", "TESTS_AND_DAMAGE"]:
-        filename = f"{hemi}_data_{imp}_filtered_80.csv"
-        source_path = os.path.join(base_source_path, folder, f"{hemi}_DATA", filename)
-    elif folder == "DECO_AND_DAMAGE":
-        filename = f"{hemi}_data_filtered_80.csv"
-        source_path = os.path.join(base_source_path, folder, f"{hemi}_DATA", filename)
-    elif folder == "DAMAGE":
-        filename = f"{hemi}_Percent_Damage_filtered_80.csv"
-        source_path = os.path.join(base_source_path, folder, filename)
-    elif folder == "DECO":
-        filename = f"{hemi}_D_Data_Synth_filtered_80.csv"
-        source_path = os.path.join(base_source_path, folder, filename)
-    elif folder == "TESTS":
-        filename = f"Pre_Network_{imp}.csv"
-        source_path = os.path.join(base_source_path, folder, "4_PRE_NETWORK_DATA", f"{hemi}_PRE_NET_DATA", filename)
-
-    # Construct destination file path for saving the Spearman correlation matrix
-    if which_layers in ["deco_and_damage", "deco", "damage"]:
-        filename = f"Spearman_Corr_Matrix_{hemi}.csv"
+    return dc.path("network_source", which_layers, hemi, imp), dc.path("correlation", which_layers, hemi, imp)
+
+# Layer combinations computed for each network type
+NETWORK_LAYERS = {
+    "3_layers": ["deco_tests_damage"],
+    "2_layers": ["deco_and_tests", "tests_and_damage", "deco_and_damage"],
+    "one_by_one_layer": ["tests", "deco", "damage"]
+}
+
+# Layer combinations whose source file does not depend on the imputation
+LAYERS_WITHOUT_IMP = ["deco_and_damage", "deco", "damage"]
+
+# List every (type_of_network, layers, hemi, imp) job, imp is None for single-file layers
+def list_jobs(hemis, imps):
+    jobs = []
+    for type_of_network, which_layers in NETWORK_LAYERS.items():
+        for layers in which_layers:
+            for hemi in hemis:
+                if layers in LAYERS_WITHOUT_IMP:
+                    jobs.append((type_of_network, layers, hemi, None))
+                else:
+                    for imp in imps:
+                        jobs.append((type_of_network, layers, hemi, imp))
+    return jobs
+
+# Describe a job the same way for every log line
+def job_name(job):
+    type_of_network, layers, hemi, imp = job
+    name = "type:" + type_of_network + ';layers:' + layers + ';hemi:' + hemi
+    if imp is not None:
+        name += ";imp:" + str(imp)
+    return name
+
+# Settings shared by every job: correlation engine, its precision, the output format,
+# whether the imputation matrices are pooled into the "mean" matrix, the permutation test
+# (0 permutations = no p-value and q-value matrices), the memory budget of the permutation batches
+# and of the tiled engine, the minimum |r| of the sparse edge lists (None = no edge list), and the source
+# files read ahead of the computation with their CSV parser, and whether the peak memory of the correlations is traced
+DEFAULT_SETTINGS = {
+    "engine": "blas",
+    "dtype": np.float64,
+    "format": "csv",
+    "pool": True,
+    "permutations": 0,
+    "seed": 0,
+    "memory_budget": ps.DEFAULT_MEMORY_BUDGET,
+    "permutation_workers": 1,
+    "edge_treshold": None,
+    "prefetch": pl.DEFAULT_PREFETCH,
+    "csv_engine": "auto",
+    "trace_memory": False
+}
+
+# Decimals of the between-imputation variance CSV, whose values are much smaller than correlations
+VARIANCE_DECIMALS = 6
+
+# Destination paths of the pooled "mean" matrix and of the between-imputation variance matrix of a dataset
+def pooled_paths(type_of_network, which_layers, hemi):
+    _, mean_path = get_file_path(type_of_network, which_layers, hemi, "mean")
+    return mean_path, dc.path("between_variance", which_layers, hemi)
+
+# Key of the pool a job contributes to, None for the layers that do not depend on the imputation
+def pool_key(job):
+    type_of_network, layers, hemi, imp = job
+    if imp is None:
+        return None
+    return (type_of_network, layers, hemi)
+
+# Keep the matrix of a job for the pooling, when it is one of the imputations of a dataset
+def collect_matrix(matrices, job, matrix_corr):
+    if matrices is not None and pool_key(job) is not None and matrix_corr is not None:
+        matrices[job] = matrix_corr
+
+# Compute the Spearman correlation matrix of a source DataFrame, save it and return it
+# (None with the tiled engine, whose matrix is only on disk)
+def process_file(df, dest_path, settings=DEFAULT_SETTINGS):
+    engine = settings["engine"]
+    if engine == ce.TILED_ENGINE:
+        process_tiled(df, dest_path, settings)
+        return None
+    with rr.stage("spearman", engine=engine):
+        matrix_corr, elapsed, peak = ce.timed_spearman_corr(df, engine, settings["dtype"], settings["trace_memory"])
+    rr.note(rows=df.shape[0], columns=df.shape[1])
+    print(f"engine:{engine};shape:{df.shape[0]}x{df.shape[1]};{ce.timing_fields(elapsed, peak)}")
+    save_correlation(matrix_corr, dest_path, settings, source_counts(df))
+    save_significance(compute_pvalues(df, settings) if settings["permutations"] else None, dest_path, settings)
+    return matrix_corr
+
+# Pair counts to save with the matrix of a source: None when it has no missing values, every count being
+# its number of rows. superset_counts are sliced when given (source with the same rows as the superset).
+def source_counts(df, superset_counts=None):
+    if not df.isna().to_numpy().any():
+        return None
+    if superset_counts is not None:
+        return superset_counts.loc[df.columns, df.columns]
+    return ce.pair_counts(df)
+
+# Tiled engine: the matrix is written tile by tile to a memory-mapped binary file, and the pairs
+# with |r| >= edge_treshold to a sparse edge list, within the memory budget (pairwise-complete tiles
+# when the source has missing values)
+def process_tiled(df, dest_path, settings=DEFAULT_SETTINGS):
+    with rr.stage("spearman", engine=ce.TILED_ENGINE):
+        edges, elapsed, peak = ce.timed(ce.spearman_tiled, df, dest_path, settings["memory_budget"], settings["dtype"],
+                                        settings["edge_treshold"], trace_memory=settings["trace_memory"])
+    rr.note(rows=df.shape[0], columns=df.shape[1])
+    block = ce.tile_size(df.shape[0], df.shape[1], settings["memory_budget"])
+    print(f"engine:{ce.TILED_ENGINE};shape:{df.shape[0]}x{df.shape[1]};tile:{block};"
+          f"{ce.timing_fields(elapsed, peak)}")
+    if edges is not None:
+        with rr.stage("write_edges"):
+            ms.write_edges(df.columns, *edges, settings["edge_treshold"], dest_path)
+        print(f"edges:{len(edges[0])};min_treshold:{settings['edge_treshold']}")
+    else:
+        ms.remove_stale(ms.edges_path(dest_path))
+    if df.isna().to_numpy().any():
+        with rr.stage("write_pair_counts"):
+            ms.write_binary_rows(df.columns, ms.pair_counts_path(dest_path), ce.pair_count_blocks(df, block))
+    else:
+        ms.remove_matrix(ms.pair_counts_path(dest_path))
+    # No permutations with the tiled engine
+    save_significance(None, dest_path, settings)
+
+# Save a correlation matrix in the configured format(s), written atomically, with the number of observations
+# of each pair when given (source with missing values) and its edge list with edge_treshold
+def save_correlation(matrix_corr, dest_path, settings=DEFAULT_SETTINGS, counts=None):
+    with rr.stage("write_matrix", format=settings["format"]):
+        ms.write_matrix(matrix_corr, dest_path, settings["format"])
+        if counts is not None:
+            ms.write_matrix(counts, ms.pair_counts_path(dest_path), settings["format"], 0)
+        else:
+            # Pair counts of an earlier build from other data would no longer match the matrix
+            ms.remove_matrix(ms.pair_counts_path(dest_path))
+    if settings["edge_treshold"] is not None:
+        save_edges(matrix_corr, dest_path, settings)
     else:
-        filename = f"Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    dest_path = os.path.join(base_dest_path, folder, filename)
+        # An edge list of an earlier build would no longer match the matrix
+        ms.remove_stale(ms.edges_path(dest_path))
+
+# Save the pairs of a correlation matrix with |r| >= edge_treshold as a sparse edge list next to it
+def save_edges(matrix_corr, dest_path, settings=DEFAULT_SETTINGS):
+    with rr.stage("write_edges"):
+        intervals = ee.threshold_intervals(settings["edge_treshold"])
+        # The coefficients as read back from the written matrix, so that both give the same graphs
+        rows, cols, weights = ee.extract_edges(ms.stored_values(matrix_corr, settings["format"]), intervals)
+        ms.write_edges(matrix_corr.columns, rows, cols, weights, settings["edge_treshold"], dest_path)
+
+# Permutation p-values of the Spearman matrix of a source DataFrame (pairwise-complete with missing values)
+def compute_pvalues(df, settings=DEFAULT_SETTINGS):
+    start = time.perf_counter()
+    with rr.stage("permutations", permutations=settings["permutations"]):
+        pvalues = ps.permutation_pvalues(df, settings["permutations"], settings["seed"], settings["memory_budget"],
+                                         settings["permutation_workers"])
+    print(f"permutations:{settings['permutations']};time:{time.perf_counter() - start:.3f}s")
+    return pvalues
+
+# Save the p-values of a matrix and their FDR q-values, the family being the pairs of this matrix.
+# Without p-values, the p-value and q-value matrices of an earlier build no longer match the matrix and are removed.
+def save_significance(pvalues, dest_path, settings=DEFAULT_SETTINGS):
+    pvalue_path, qvalue_path = ps.significance_paths(dest_path)
+    if pvalues is None:
+        ms.remove_matrix(pvalue_path)
+        ms.remove_matrix(qvalue_path)
+        return
+    with rr.stage("write_significance", format=settings["format"]):
+        ms.write_matrix(pvalues, pvalue_path, settings["format"], ps.SIGNIFICANCE_DECIMALS)
+        ms.write_matrix(ps.fdr_qvalues(pvalues), qvalue_path, settings["format"], ps.SIGNIFICANCE_DECIMALS)
+
+# Files written for a job: its matrix, its pair counts (computed matrices whose source has missing values,
+# listed when the last build wrote them), and its p-value and q-value matrices when permutations are run
+def job_outputs(dest_path, settings=DEFAULT_SETTINGS, pair_counts=True):
+    outputs = ms.output_files(dest_path, settings["format"])
+    if pair_counts and ms.matrix_exists(ms.pair_counts_path(dest_path)):
+        outputs += ms.output_files(ms.pair_counts_path(dest_path), settings["format"])
+    if settings["permutations"]:
+        for path in ps.significance_paths(dest_path):
+            outputs += ms.output_files(path, settings["format"])
+    if settings["edge_treshold"] is not None:
+        outputs.append(ms.edges_path(dest_path))
+    return outputs
+
+# Compute each job from its own source file, returns the (job name, seconds) timings.
+# The matrices of the imputation jobs are kept in matrices (job -> matrix) when it is given.
+def run_separate(jobs, settings=DEFAULT_SETTINGS, matrices=None):
+    timings = []
+    # The source files are read ahead on a thread pool while the previous matrices are computed
+    sources = pl.prefetch_csv([get_file_path(*job)[0] for job in jobs], settings["prefetch"], settings["csv_engine"])
+    for job, (source_path, df) in zip(jobs, sources):
+        start = time.perf_counter()
+        _, dest_path = get_file_path(*job)
+        print(job_name(job))
+        if df is None:
+            print(f"File does not exist: {source_path}")
+            continue
+
+        # Compute Spearman correlation matrix, and save it
+        with rr.job(job_name(job)):
+            collect_matrix(matrices, job, process_file(df, dest_path, settings))
+        timings.append((job_name(job), time.perf_counter() - start))
+    return timings
 
-    return source_path, dest_path
+# True when every column of df is also in superset_df with exactly the same rows
+def is_column_subset(df, superset_df):
+    if len(df) != len(superset_df) or not set(df.columns).issubset(superset_df.columns):
+        return False
+    values = df.to_numpy(dtype=np.float64)
+    superset_values = superset_df[list(df.columns)].to_numpy(dtype=np.float64)
+    return np.array_equal(values, superset_values, equal_nan=True)
+
+# Group the jobs by the 3-layer (hemi, imp) matrix they can be sliced from.
+# Single-file layers do not depend on the imputation and go with the first imputation.
+def plan_superset(jobs, imps):
+    groups = {}
+    for job in jobs:
+        _, _, hemi, imp = job
+        key = (hemi, imp if imp is not None else imps[0])
+        groups.setdefault(key, []).append(job)
+    return groups
+
+# Spearman coefficients only depend on the two columns involved (pairwise-complete ranks
+# with missing values), so every 2-layer and 1-layer matrix is a block of the 3-layer matrix
+# computed on the same rows: compute the superset once for (hemi, imp) and slice it.
+def run_superset_group(hemi, imp, group_jobs, settings=DEFAULT_SETTINGS, matrices=None):
+    superset_path, _ = get_file_path("3_layers", "deco_tests_damage", hemi, imp)
+    if len(group_jobs) == 1 and get_file_path(*group_jobs[0])[0] != superset_path:
+        # A single subset left to build (the others are up to date): its own file is cheaper
+        return run_separate(group_jobs, settings, matrices)
+    if not dc.exists(superset_path):
+        print(f"File does not exist: {superset_path}")
+        return run_separate(group_jobs, settings, matrices)
+
+    timings = []
+    # The superset and the subset sources are read ahead on a thread pool while the matrices are computed
+    subset_paths = [get_file_path(*job)[0] for job in group_jobs if get_file_path(*job)[0] != superset_path]
+    sources = pl.prefetch_csv([superset_path] + subset_paths, settings["prefetch"], settings["csv_engine"])
+    start = time.perf_counter()
+    engine = settings["engine"]
+    with rr.job(f"superset:hemi:{hemi};imp:{imp}"):
+        _, superset_df = next(sources)
+        with rr.stage("spearman", engine=engine):
+            superset_corr, elapsed, peak = ce.timed_spearman_corr(superset_df, engine, settings["dtype"],
+                                                                  settings["trace_memory"])
+            superset_counts = ce.pair_counts(superset_df)
+        rr.note(rows=superset_df.shape[0], columns=superset_df.shape[1])
+        print(f"superset:hemi:{hemi};imp:{imp};engine:{engine};shape:{superset_df.shape[0]}x{superset_df.shape[1]};"
+              f"{ce.timing_fields(elapsed, peak)}")
+        # Permutation p-values of a pair only depend on its two columns: they are sliced like the matrix
+        superset_pvalues = compute_pvalues(superset_df, settings) if settings["permutations"] else None
+    timings.append((f"superset:hemi:{hemi};imp:{imp}", time.perf_counter() - start))
+
+    for job in group_jobs:
+        start = time.perf_counter()
+        source_path, dest_path = get_file_path(*job)
+        print(job_name(job))
+        df = next(sources)[1] if source_path != superset_path else superset_df
+        if df is None:
+            print(f"File does not exist: {source_path}")
+            continue
+        with rr.job(job_name(job)):
+            if source_path == superset_path:
+                matrix_corr = superset_corr
+                save_correlation(matrix_corr, dest_path, settings, source_counts(df, superset_counts))
+                save_significance(superset_pvalues, dest_path, settings)
+            else:
+                if is_column_subset(df, superset_df):
+                    # Same rows as the superset source: the matrix is a slice of the superset matrix
+                    with rr.stage("slice"):
+                        matrix_corr = superset_corr.loc[df.columns, df.columns]
+                    rr.note(rows=df.shape[0], columns=df.shape[1])
+                    save_correlation(matrix_corr, dest_path, settings, source_counts(df, superset_counts))
+                    subset_pvalues = superset_pvalues.loc[df.columns, df.columns] if superset_pvalues is not None else None
+                    save_significance(subset_pvalues, dest_path, settings)
+                else:
+                    # Different rows: fall back to a separate computation
+                    print(f"Rows differ from {superset_path}, computing separately.")
+                    matrix_corr = process_file(df, dest_path, settings)
+        collect_matrix(matrices, job, matrix_corr)
+        timings.append((job_name(job), time.perf_counter() - start))
+    return timings
+
+# Split the jobs into independent work units: one per job, or one per (hemi, imp) superset
+def plan_units(jobs, imps, plan="superset"):
+    if plan == "superset":
+        return [("superset", hemi, imp, group_jobs)
+                for (hemi, imp), group_jobs in plan_superset(jobs, imps).items()]
+    return [("separate", None, None, [job]) for job in jobs]
+
+# Run one work unit and return its log, timings and imputation matrices (when pooling) instead of
+# printing them, so that the parent process can print the logs and pool the matrices in a deterministic order
+def run_unit(unit, settings=DEFAULT_SETTINGS):
+    plan, hemi, imp, unit_jobs = unit
+    log = io.StringIO()
+    matrices = {} if settings["pool"] else None
+    with contextlib.redirect_stdout(log):
+        if plan == "superset":
+            timings = run_superset_group(hemi, imp, unit_jobs, settings, matrices)
+        else:
+            timings = run_separate(unit_jobs, settings, matrices)
+    return log.getvalue(), timings, matrices
+
+# Run every work unit, in this process (workers=1) or on a process pool.
+# Logs are printed in the order of the units, whatever order they finish in. The imputation
+# matrices are added to their pool (key -> FisherZPool) as the units are collected, then dropped.
+def run_units(units, settings=DEFAULT_SETTINGS, workers=1, pools=None):
+    timings = []
+
+    def collect(result):
+        log, unit_timings, matrices = result
+        print(log, end='')
+        timings.extend(unit_timings)
+        for job, matrix_corr in (matrices or {}).items():
+            if pools is not None:
+                pools.setdefault(pool_key(job), ip.FisherZPool()).add(matrix_corr)
+
+    if workers == 1:
+        for unit in units:
+            collect(run_unit(unit, settings))
+        return timings
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_unit, unit, settings) for unit in units]
+        for future in futures:
+            collect(future.result())
+    return timings
+
+# Write the pooled "mean" matrix and the between-imputation variance of every complete pool
+def save_pools(pools, imps, settings=DEFAULT_SETTINGS):
+    for key, pool in pools.items():
+        print("pooled:" + job_name(key + ("mean",)) + f";imputations:{pool.count}")
+        if pool.count != len(imps):
+            print(f"Only {pool.count} of {len(imps)} imputations available, not pooled.")
+            continue
+        mean_path, variance_path = pooled_paths(*key)
+        with rr.job("pooled:" + job_name(key + ("mean",)), imputations=pool.count):
+            with rr.stage("write_matrix", format=settings["format"]):
+                ms.write_matrix(pool.between_variance(), variance_path, settings["format"], VARIANCE_DECIMALS)
+            save_correlation(pool.pooled_matrix(), mean_path, settings)
+
+# Print the time spent on each job, slowest first
+def print_timing_summary(timings, wall_time):
+    print("\nTiming summary:")
+    for name, seconds in sorted(timings, key=lambda timing: timing[1], reverse=True):
+        print(f"{seconds:8.3f}s  {name}")
+    print(f"{len(timings)} jobs, {sum(seconds for _, seconds in timings):.3f}s of work, {wall_time:.3f}s wall time")
+
+# Parameters recorded in the build manifest for a job
+def job_params(job, settings):
+    type_of_network, layers, hemi, imp = job
+    return {"type": type_of_network, "layers": layers, "hemi": hemi, "imp": imp, "engine": settings["engine"],
+            "dtype": str(np.dtype(settings["dtype"])), "format": settings["format"],
+            "permutations": settings["permutations"], "seed": settings["seed"], "edge_treshold": settings["edge_treshold"]}
+
+# Outputs, inputs and parameters recorded in the build manifest for the pool of a dataset
+def pool_build(key, imps, settings):
+    mean_path, variance_path = pooled_paths(*key)
+    outputs = job_outputs(mean_path, dict(settings, permutations=0), pair_counts=False) + ms.output_files(variance_path, settings["format"])
+    inputs = [get_file_path(*key, imp)[0] for imp in imps]
+    params = job_params(key + ("mean",), settings)
+    params["imps"] = list(imps)
+    return outputs, inputs, params
+
+# Keep the jobs whose outputs are missing or were built from other inputs, parameters or code.
+# When pooling, every imputation of a dataset whose pooled matrices are outdated is recomputed,
+# since the pool is accumulated from the matrices in memory.
+def outdated_jobs(jobs, manifest, settings, code, imps):
+    outdated_pools = set()
+    if settings["pool"]:
+        for key in dict.fromkeys(pool_key(job) for job in jobs if pool_key(job) is not None):
+            outputs, inputs, params = pool_build(key, imps, settings)
+            # A pool with missing imputation files cannot be completed, its jobs are not forced
+            if all(dc.exists(path) for path in inputs) and not manifest.is_up_to_date(outputs, inputs, params, code):
+                outdated_pools.add(key)
+
+    pending = []
+    for job in jobs:
+        source_path, dest_path = get_file_path(*job)
+        outputs = job_outputs(dest_path, settings)
+        if pool_key(job) not in outdated_pools and manifest.is_up_to_date(outputs, [source_path], job_params(job, settings), code):
+            print(job_name(job) + ";up to date")
+        else:
+            pending.append(job)
+    return pending
+
+# Record the jobs and the pools that produced their outputs
+def record_jobs(jobs, manifest, settings, code, pools=None, imps=None):
+    for job in jobs:
+        source_path, dest_path = get_file_path(*job)
+        # The outputs may have been written by worker processes, unknown to this catalog
+        dc.refresh(ms.output_files(ms.pair_counts_path(dest_path), "both"))
+        outputs = job_outputs(dest_path, settings)
+        dc.refresh(outputs)
+        if dc.exists(source_path) and all(dc.exists(output) for output in outputs):
+            manifest.record(outputs, [source_path], job_params(job, settings), code)
+    for key, pool in (pools or {}).items():
+        if pool.count == len(imps):
+            manifest.record(*pool_build(key, imps, settings), code)
+    manifest.save()
 
 # Main block to loop through all network types, layers, hemispheres, and imputations (if needed)
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the Spearman correlation matrices of every network.")
+    parser.add_argument("--engine", choices=ce.ENGINES + [ce.TILED_ENGINE], default="blas",
+                        help="pandas: df.corr(method='spearman'); blas: rank once + one matrix multiply; "
+                             "tiled: blas tile by tile into a memory-mapped binary matrix, for very wide data "
+                             "(implies --format bin --plan separate --no-pool)")
+    parser.add_argument("--dtype", choices=["float64", "float32"], default="float64",
+                        help="Precision of the blas engine matrix multiply")
+    parser.add_argument("--plan", choices=["superset", "separate"], default="superset",
+                        help="superset: slice every matrix from the 3-layer matrix of the same hemi/imp; "
+                             "separate: compute every matrix from its own file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes (0 = one per CPU core)")
+    parser.add_argument("--format", choices=ms.MATRIX_FORMATS, default="csv",
+                        help="csv: rounded semicolon CSV; bin: memory-mappable float32 array + JSON sidecar; both")
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every matrix, even those whose inputs, parameters and code are unchanged")
+    parser.add_argument("--no-pool", action="store_true",
+                        help="Do not pool the imputation matrices into the 'mean' and between-imputation variance matrices")
+    parser.add_argument("--permutations", type=int, default=0,
+                        help="Permutations of the significance test writing p-value and FDR q-value matrices (0 = none)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the permutations")
+    parser.add_argument("--memory-budget", type=float, default=ps.DEFAULT_MEMORY_BUDGET / 2**20,
+                        help="Memory (MB) of one batch of permuted correlation matrices, and of the tiles of --engine tiled")
+    parser.add_argument("--edge-treshold", type=float, default=None,
+                        help="Also write the pairs with |r| >= this value as a sparse edge list next to each matrix, "
+                             "read by the graph scripts instead of the dense matrix")
+    parser.add_argument("--permutation-workers", type=int, default=1,
+                        help="Worker processes of the permutation batches of each matrix (0 = one per CPU core), "
+                             "only with --workers 1")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the peak Python memory of every correlation (tracemalloc slows the engines "
+                             "down: the times of a traced run are not comparable with an untraced one)")
+    pl.add_arguments(parser)
+    rr.add_arguments(parser)
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    permutation_workers = args.permutation_workers if args.permutation_workers > 0 else os.cpu_count()
+    if workers > 1 and permutation_workers > 1:
+        parser.error("--permutation-workers needs --workers 1, the matrices already run on a process pool")
+    if args.engine == ce.TILED_ENGINE:
+        if args.permutations:
+            parser.error("--permutations needs an in-memory engine, not --engine tiled")
+        # Tiled matrices only exist on disk: they are neither written as CSV, nor sliced, nor pooled
+        args.format, args.plan, args.no_pool = "bin", "separate", True
+    settings = {
+        "engine": args.engine,
+        "dtype": np.dtype(args.dtype),
+        "format": args.format,
+        "pool": not args.no_pool,
+        "permutations": args.permutations,
+        "seed": args.seed,
+        "memory_budget": args.memory_budget * 2**20,
+        "permutation_workers": permutation_workers,
+        "edge_treshold": args.edge_treshold,
+        "prefetch": args.prefetch,
+        "csv_engine": args.csv_engine,
+        "trace_memory": args.trace_memory
+    }
+
     hemis = ['L', 'R']  # List of hemispheres
     imps = [1, 2, 3, 4, 5]  # List of imputation indices
 
-    type_of_networks = ["3_layers", "2_layers", "one_by_one_layer"]  # List of network types
-    
-    for type_of_network in type_of_networks:
-        # Define corresponding layers based on the network type
-        if type_of_network == "3_layers":
-            which_layers = ["deco_tests_damage"]
-        elif type_of_network == "2_layers":
-            which_layers = ["deco_and_tests", "tests_and_damage", "deco_and_damage"]
-        elif type_of_network == "one_by_one_layer":
-            which_layers = ["tests", "deco", "damage"]
-        else:
-            print("Error: wrong type of network.")
-        
-        # Loop through each layer combination and hemisphere
-        for layers in which_layers:
-            for hemi in hemis:
-                # For single-file layers (without imputations)
-                if layers in ["deco_and_damage", "deco", "damage"]:
-                    source_path, dest_path = get_file_path(type_of_network, layers, hemi)
-                    print("type:" + type_of_network + ';layers:' + layers + ';hemi:' + hemi)
-                    if not os.path.exists(source_path):
-                        print(f"File does not exist: {source_path}")
-                        continue
-
-                    # Read the data, compute Spearman correlation matrix, and save it
-                    df = pd.read_csv(source_path, delimiter=';')
-                    matrix_corr = df.corr(method='spearman')
-                    df_corr = pd.DataFrame(matrix_corr)
-                    df_corr.insert(0, 'Name', df_corr.index)
-                    df_corr = df_corr.round(3)
-                    df_corr.to_csv(dest_path, sep=';', index=False)
-                
-                # For cases with multiple imputations
-                else:
-                    for imp in imps:
-                        source_path, dest_path = get_file_path(type_of_network, layers, hemi, imp)
-                        print("type:" + type_of_network + ';layers:' + layers + ';hemi:' + hemi + ";imp:" + str(imp))
-                        if not os.path.exists(source_path):
-                            print(f"File does not exist: {source_path}")
-                            continue
-
-                        # Read the data, compute Spearman correlation matrix, and save it
-                        df = pd.read_csv(source_path, delimiter=';')
-                        matrix_corr = df.corr(method='spearman')
-                        df_corr = pd.DataFrame(matrix_corr)
-                        df_corr.insert(0, 'Name', df_corr.index)
-                        df_corr = df_corr.round(3)
-                        df_corr.to_csv(dest_path, sep=';', index=False)
+    start = time.perf_counter()
+    rr.start_from_args("Correlation_Matrix_Creation", args)
+    dc.start_from_args(args, CATALOG_STAGES)
+    manifest = bm.BuildManifest(dc.path("correlation_manifest"), force=args.force)
+    code = bm.code_version(__file__, ce, ee, ms, ip, ps)
+    jobs = outdated_jobs(list_jobs(hemis, imps), manifest, settings, code, imps)
+    units = plan_units(jobs, imps, args.plan)
+    pools = {}  # (type_of_network, layers, hemi) -> Fisher-z pool of its imputation matrices
+    timings = run_units(units, settings, workers, pools)
+    save_pools(pools, imps, settings)
+    record_jobs(jobs, manifest, settings, code, pools, imps)
+    print_timing_summary(timings, time.perf_counter() - start)
+    rr.finish()
@@ -1,206 +1,237 @@
 from my_globals import *
-import pandas as pd
+import argparse
 import networkx as nx
 import os
 from pyvis.network import Network
 from IPython.display import IFrame
 import network_manipulation as nm
-
-# Function to determine file path based on selected layers, hemisphere, and imputation
-def get_path(layers, hemi, imp):
-    if layers == [1,2,3]:
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_TESTS_DAMAGE\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [1,2]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_AND_TESTS\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [1,3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\TESTS_AND_DAMAGE\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [2,3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_AND_DAMAGE\Spearman_Corr_Matrix_{hemi}.csv"
-    elif layers == [1]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\TESTS\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [2]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO\Spearman_Corr_Matrix_{hemi}.csv"
-    elif layers == [3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DAMAGE\Spearman_Corr_Matrix_{hemi}.csv"
-    else:
-        print("Error: Wrong layers.")
-        return 0
+import matrix_storage as ms
+import edge_extraction as ee
+import node_layout as nl
+import network_centrality as nc
+import build_manifest as bm
+import interactive_export as ie
+import permutation_significance as ps
+import run_report as rr
+import data_catalog as dc
+
+# Stages of the data catalog read and written by this script
+CATALOG_STAGES = ["correlation", "interactive_page", "interactive_analysis"]
+
+# Define colors for each layer
+layer_colors = {
+    1: '#00008d',  # Blue: neuropsychological scores
+    2: '#006300',  # Green: subcortical damage
+    3: '#fb0000'   # Red: cortical damage
+}
+
+# Pixels per unit of the cached node layout (node_layout)
+LAYOUT_PIXELS = 150
+
+# Node and edge appearance of the plain networks. The nodes are placed at their cached layout
+# positions, physics is disabled so that the page opens without a simulation to settle
+NET_OPTIONS = """
+{
+    "nodes": {
+        "color": {"inherit": true},
+        "font": {"face": "Tahoma"}
+    },
+    "edges": {
+        "color": {
+            "inherit": true,
+            "color": "rgba(211,211,211,0.5)",
+            "highlight": "black",
+            "hover": "black"
+        },
+        "hoverWidth": 1,
+        "smooth": false
+    },
+    "physics": {"enabled": false}
+}
+"""
+
+# Node and edge appearance of the networks sized by a centrality
+NET_ANALYSES_OPTIONS = """
+var options = {
+    "nodes": {
+        "opacity": 0.2,
+        "scaling": {"min": 10, "max": 30},
+        "color": {
+            "inherit": true,
+            "color": "rgba(0,0,0,0.2)",
+            "highlight": "black",
+            "hover": "black"
+        },
+        "font": {"face": "Tahoma"}
+    },
+    "edges": {
+        "color": {
+            "inherit": true,
+            "color": "rgba(0,0,0,0.2)",
+            "highlight": "black",
+            "hover": "black"
+        },
+        "opacity": 0.2,
+        "smooth": {"enabled": false, "type": "dynamic"}
+    },
+    "interaction": {
+        "hover": false,
+        "tooltipDelay": 200,
+        "hideEdgesOnDrag": false,
+        "hideNodesOnDrag": false
+    },
+    "physics": {"enabled": false}
+}
+"""
+
+# HTML legend added to the visualizations
+LEGEND_HTML = """
+<div style="position: absolute; top: 10px; right: 10px; background: white; padding: 10px; border: 1px solid #ccc; font-family: Tahoma; font-size: 14px; z-index: 999;">
+<strong>Légende</strong><br>
+<span style="color:#00008d;">■</span> NT<br>
+<span style="color:#006300;">■</span> SD<br>
+<span style="color:#fb0000;">■</span> CD<br>
+"""
+
+# Build the graph of a correlation matrix (DataFrame or sparse edge list): one node per variable, colored by layer
+# and placed at its cached layout position, and one edge per positive correlation above the threshold
+# (and with q <= alpha when q-values are given)
+def build_graph(source, treshold, qvalues=None, alpha=None):
+    G = nx.Graph()
+    names = ee.source_names(source)
+    positions = nl.cached_layout(names)
+    for node in names:
+        color = layer_colors.get(nm.get_layer(node))
+        x, y = positions[str(node)]
+        G.add_node(node, label=str(node), color=color, opacity=0.2, x=x * LAYOUT_PIXELS, y=y * LAYOUT_PIXELS)
+
+    # Add edges based on correlation strength, upper triangle only
+    intervals = ee.threshold_intervals(treshold, negative=False)
+    ee.add_source_edges([G], source, intervals, weight_scale=10, qvalues=qvalues, alpha=alpha)
+    return G
+
+# Render a graph with Pyvis and write it as an HTML file with the legend
+def write_html(G, options, file_path_destination):
+    with rr.stage("generate_html", nodes=G.number_of_nodes(), edges=G.number_of_edges()):
+        net = Network(notebook=True, cdn_resources='in_line')
+        net.from_nx(G, show_edge_weights=True)
+        net.set_options(options)
+        html_content = net.generate_html() + LEGEND_HTML
+    with rr.stage("write_html"):
+        with open(file_path_destination, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+    dc.record(file_path_destination)
 
 # Main script entry point
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Interactive HTML networks of the correlation matrices.")
+    parser.add_argument("--force", action="store_true", help="Rebuild every page, even those that are up to date")
+    parser.add_argument("--export", choices=["pages", "shared", "both"], default="pages",
+                        help="pages: one self-contained HTML file per network (default); "
+                             "shared: one dashboard with shared assets loading each network on demand; both: the two")
+    parser.add_argument("--alpha", type=float, default=None,
+                        help="Also require an FDR q-value <= alpha (q-value matrices of Correlation_Matrix_Creation --permutations)")
+    parser.add_argument("--tresholds", type=float, nargs='+', default=[0.175, 0.229],
+                        help="Correlation thresholds (0 keeps every significant pair with --alpha)")
+    rr.add_arguments(parser)
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    rr.start_from_args("Interactive_Networks", args)
+    dc.start_from_args(args, CATALOG_STAGES)
+    write_pages = args.export in ("pages", "both")
+    write_shared = args.export in ("shared", "both")
 
     layers = [1]  # Define which layers to analyze: [1]=NT, [2]=SD, [3]=CD, [1,2], [1,3], [2,3], [1,2,3]
     hemis = ['L', 'R']  # Hemispheres: Left and Right
     imps = ['1', '2', '3', '4', '5', 'mean']  # Imputation strategies
-    network_analyses = ["betweenness_centrality", "closeness_centrality", "degree_centrality", "clustering_coefficient"]
+    network_analyses = list(nc.NETWORK_ANALYSES)
     label = nm.get_label(layers)  # Get the appropriate label for the combination of layers
-    tresholds = [0.175, 0.229]  # Thresholds for correlation filtering (e.g., p<0.05, p<0.01)
-
-    for network_analysis in network_analyses:
-        for treshold in tresholds:
-            for hemi in hemis:
-                for imp in imps:
-                    # Load the corresponding correlation matrix file
-                    file_path = get_path(layers, hemi, imp)
-
-                    if not os.path.exists(file_path):
-                        print(f"File does not exist for hemisphere {hemi}, imputation {imp}.")
-                    else:
-                        df = pd.read_csv(file_path, delimiter=';')
-                        df = df.drop("Name", axis=1)  # Remove identifier column
-
-                        # Create empty NetworkX graphs
-                        G = nx.Graph()
-                        G_analyses = nx.Graph()
-
-                        # Define colors for each layer
-                        layer_colors = {
-                            1: '#00008d',  # Blue: neuropsychological scores
-                            2: '#006300',  # Green: subcortical damage
-                            3: '#fb0000'   # Red: cortical damage
-                        }
-
-                    # Choose appropriate network analysis file path
-                    if layers in [[2], [2, 3], [3]]:
-                        file_path_analyses = rf"{MAIN_PATH}\Coding\Networks_Analyses\Analyses\{treshold}\{network_analysis}\{hemi}\{label}\{label}_{network_analysis}_{hemi}.csv"
-                    else:
-                        file_path_analyses = rf"{MAIN_PATH}\Coding\Networks_Analyses\Analyses\{treshold}\{network_analysis}\{hemi}\{label}\{label}_{network_analysis}_{hemi}_{imp}.csv"
-
-                    if not os.path.exists(file_path_analyses):
-                        print(f"Analysis file does not exist for hemisphere {hemi}, imputation {imp}.")
-                    else:
-                        net_analyses_df = pd.read_csv(file_path_analyses, delimiter=';')
-                        # Map node sizes from centrality values
-                        node_sizes = {
-                            row[net_analyses_df.columns[0]]: row[net_analyses_df.columns[1]]
-                            for idx, row in net_analyses_df.iterrows()
-                        }
-
-                        # Add nodes to both graphs
-                        for node in df.columns[1:]:
-                            layer = nm.get_layer(node)
-                            color = layer_colors.get(layer)
-                            size = node_sizes.get(node, 10) * 100  # Scale centrality for visualization
-                            G.add_node(node, label=str(node), color=color, opacity=0.2)
-                            G_analyses.add_node(node, label=str(node), color=color, opacity=0.2, size=size)
-
-                        # Define thresholds for filtering edges
-                        min_pos__tresh = treshold
-                        max_pos__tresh = 1
-
-                        # Add edges based on correlation strength
-                        for j, node1 in enumerate(df.columns[1:]):
-                            for k, node2 in enumerate(df.columns[1:]):
-                                if j < k:
-                                    weight = df.iloc[j+1, k+1]
-                                    if min_pos__tresh <= weight <= max_pos__tresh:
-                                        G.add_edge(node1, node2, weight=weight*10)
-                                        G_analyses.add_edge(node1, node2, weight=weight*10)
-
-                        # Create Pyvis visualizations
-                        net = Network(notebook=True, cdn_resources='in_line')
-                        net.from_nx(G, show_edge_weights=True)
-
-                        net_analyses = Network(notebook=True, cdn_resources='in_line')
-                        net_analyses.from_nx(G_analyses, show_edge_weights=True)
-
-                        # Set node and edge appearance
-                        net.set_options("""
-                        {
-                            "nodes": {
-                                "color": {"inherit": true},
-                                "font": {"face": "Tahoma"}
-                            },
-                            "edges": {
-                                "color": {
-                                    "inherit": true,
-                                    "color": "rgba(211,211,211,0.5)",
-                                    "highlight": "black",
-                                    "hover": "black"
-                                },
-                                "hoverWidth": 1,
-                                "smooth": false
-                            }
-                        }
-                        """)
-
-                        net_analyses.set_options("""
-                        var options = {
-                            "nodes": {
-                                "opacity": 0.2,
-                                "scaling": {"min": 10, "max": 30},
-                                "color": {
-                                    "inherit": true,
-                                    "color": "rgba(0,0,0,0.2)",
-                                    "highlight": "black",
-                                    "hover": "black"
-                                },
-                                "font": {"face": "Tahoma"}
-                            },
-                            "edges": {
-                                "color": {
-                                    "inherit": true,
-                                    "color": "rgba(0,0,0,0.2)",
-                                    "highlight": "black",
-                                    "hover": "black"
-                                },
-                                "opacity": 0.2,
-                                "smooth": {"enabled": false, "type": "dynamic"}
-                            },
-                            "interaction": {
-                                "hover": false,
-                                "tooltipDelay": 200,
-                                "hideEdgesOnDrag": false,
-                                "hideNodesOnDrag": false
-                            },
-                            "physics": {
-                                "barnesHut": {
-                                    "gravitationalConstant": -20000,
-                                    "centralGravity": 0.3,
-                                    "springLength": 250,
-                                    "springConstant": 0.04,
-                                    "damping": 0.09
-                                },
-                                "minVelocity": 0.0,
-                                "solver": "barnesHut"
-                            }
-                        }
-                        """)
-
-                        # Generate HTML visualizations
-                        html_content = net.generate_html()
-                        html_content_analyses = net_analyses.generate_html()
-
-                        # Create output directories
-                        output_dir = os.path.join(MAIN_PATH_WIN, f"Coding/Correlation_Matrix/Interactive_Plots/{treshold}/{hemi}/{label}")
-                        output_dir_analyses = os.path.join(MAIN_PATH_WIN, f"Coding/Networks_Analyses/Analyses/{treshold}/{network_analysis}/{hemi}/{label}/")
-
+    tresholds = args.tresholds  # Thresholds for correlation filtering (e.g., p<0.05, p<0.01 for 126 patients)
+    cache_dir = dc.path("centrality_cache")  # Centralities keyed on the matrix content
+    manifest = bm.BuildManifest(dc.path("interactive_manifest"), force=args.force)
+    code = bm.code_version(__file__, ee, nl, nc, ms, ie, ps)
+    shared_root = dc.path("interactive_dashboard", layers)  # Dashboard of --export shared
+
+    for treshold in tresholds:
+        key = ee.treshold_key(treshold, args.alpha)  # Threshold name in the output paths
+        for hemi in hemis:
+            for imp in imps:
+                # Load the corresponding correlation matrix file
+                file_path = dc.path("correlation", layers, hemi, imp)
+
+                if not ms.matrix_exists(file_path):
+                    print(f"File does not exist for hemisphere {hemi}, imputation {imp}.")
+                    continue
+
+                # Destination file paths: the plain network and one network per centrality
+                file_path_destination = dc.path("interactive_page", layers, hemi, imp, treshold=key)
+                output_dir = os.path.dirname(file_path_destination)
+                file_paths_analyses_destination = {network_analysis: dc.path("interactive_analysis", layers, hemi, imp, treshold=key,
+                                                                             analysis=network_analysis)
+                                                   for network_analysis in network_analyses}
+
+                # Skip the pages built from the same matrix, parameters and code
+                outputs = []
+                if write_pages:
+                    outputs += [file_path_destination] + list(file_paths_analyses_destination.values())
+                if write_shared:
+                    outputs.append(os.path.join(shared_root, ie.payload_path(key, hemi, imp)))
+                intervals = ee.threshold_intervals(treshold, negative=False)
+                inputs = ee.source_files(file_path, intervals)
+                if args.alpha is not None:
+                    qvalue_path = ps.significance_paths(file_path)[1]
+                    if not ms.matrix_exists(qvalue_path):
+                        print(f"No q-values for hemisphere {hemi}, imputation {imp}.")
+                        continue
+                    inputs = inputs + ms.matrix_files(qvalue_path)
+                params = {"layers": layers, "treshold": treshold, "alpha": args.alpha, "hemi": hemi, "imp": imp}
+                if manifest.is_up_to_date(outputs, inputs, params, code):
+                    continue
+
+                with rr.job(f"treshold:{key};hemi:{hemi};imp:{imp};layers:{label}"):
+                    with rr.stage("load_matrix"):
+                        # Sparse edge list when it holds every edge of the threshold, the matrix otherwise
+                        # (binary if available, CSV without its "Name" column otherwise)
+                        source = ee.load_source(file_path, intervals)
+                        qvalues = ps.load_qvalues(file_path) if args.alpha is not None else None
+
+                    # Build the graph once and compute every centrality on it (or read them from the cache)
+                    with rr.stage("build_graph"):
+                        G = build_graph(source, treshold, qvalues, args.alpha)
+                    rr.note(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+                    edge_rule = "positive"
+                    if qvalues is not None:
+                        # The edges also depend on the q-values, which are part of the cache key
+                        edge_rule = f"positive_q{args.alpha}_{nc.matrix_hash(qvalues)[:12]}"
+                    with rr.stage("centrality"):
+                        centralities = nc.cached_centralities(G, source, treshold, cache_dir, edge_rule)
+
+                    # Node sizes of every centrality, scaled for visualization
+                    sizes = {network_analysis: {node: float(size) for node, size in (centralities[network_analysis] * 100).items()}
+                             for network_analysis in network_analyses}
+
+                    if write_pages:
+                        # Plain network
                         os.makedirs(output_dir, exist_ok=True)
-                        os.makedirs(output_dir_analyses, exist_ok=True)
-
-                        # Define destination file paths
-                        file_path_destination = os.path.join(output_dir, f"interactiveplot_{label}_{hemi}_{imp}.html")
-
-                        if layers in [[2], [2, 3], [3]]:
-                            file_path_analyses_destination = os.path.join(output_dir_analyses, f"interactiveplot_{label}_{network_analysis}_{hemi}.html")
-                        else:
-                            file_path_analyses_destination = os.path.join(output_dir_analyses, f"interactiveplot_{label}_{network_analysis}_{hemi}_{imp}.html")
-
-                        # Add an HTML legend to the visualizations 
-                        legend_html = f"""
-                        <div style="position: absolute; top: 10px; right: 10px; background: white; padding: 10px; border: 1px solid #ccc; font-family: Tahoma; font-size: 14px; z-index: 999;">
-                        <strong>Légende</strong><br>
-                        <span style="color:#00008d;">■</span> NT<br>
-                        <span style="color:#006300;">■</span> SD<br>
-                        <span style="color:#fb0000;">■</span> CD<br>
-                        """
-
-                        # Inject legend
-                        html_content += legend_html
-                        html_content_analyses += legend_html
-                        
-                        # Write HTML files to disk
-                        with open(file_path_destination, 'w', encoding='utf-8') as f:
-                            f.write(html_content)
-                        with open(file_path_analyses_destination, 'w', encoding='utf-8') as f:
-                            f.write(html_content_analyses)
+                        write_html(G, NET_OPTIONS, file_path_destination)
+
+                        # One network per centrality, nodes sized by their centrality
+                        for network_analysis, file_path_analyses_destination in file_paths_analyses_destination.items():
+                            os.makedirs(os.path.dirname(file_path_analyses_destination), exist_ok=True)
+                            G_analyses = G.copy()
+                            nx.set_node_attributes(G_analyses, sizes[network_analysis], "size")
+                            write_html(G_analyses, NET_ANALYSES_OPTIONS, file_path_analyses_destination)
+
+                    if write_shared:
+                        # One payload holding the graph once and the node sizes of every centrality
+                        with rr.stage("write_payload"):
+                            ie.write_payload(shared_root, G, sizes, key, hemi, imp, NET_OPTIONS, NET_ANALYSES_OPTIONS)
+
+                    manifest.record(outputs, inputs, params, code)
+
+    if write_shared:
+        # vis-network and the dashboard page are written once for all the payloads
+        ie.write_assets(shared_root)
+        ie.write_dashboard(shared_root, f"Interactive networks {label}", network_analyses)
+    manifest.save()
+    rr.finish()
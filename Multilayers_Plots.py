@@ -1,12 +1,24 @@
 from my_globals import *
-import pandas as pd
+import argparse
 import networkx as nx
 import numpy as np
 import matplotlib.pyplot as plt
 from networkx import edge_betweenness_centrality as betweenness
 import os
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib.lines import Line2D  # Import for custom legend
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
 import network_manipulation as nm
+import matrix_storage as ms
+import edge_extraction as ee
+import node_layout as nl
+import build_manifest as bm
+import permutation_significance as ps
+import threshold_sweep as ts
+import run_report as rr
+import data_catalog as dc
 
 # Layer colors
 layer_colors = {
@@ -15,6 +27,12 @@ layer_colors = {
     3: '#fb0000'   # Red for cortical damages (bottom layer)
 }
 
+# Every layer combination: [1]=NT, [2]=SD, [3]=CD
+ALL_LAYERS = [[1], [2], [3], [1, 2], [1, 3], [2, 3], [1, 2, 3]]
+
+# Stages of the data catalog read and written by this script
+CATALOG_STAGES = ["correlation", "multilayers_plot", "multilayers_legend"]
+
 
 def get_z_pos(layer_index):
     # Mapping between the layer number (1,2,3) and its z position on output graph
@@ -25,25 +43,6 @@ def get_z_pos(layer_index):
     }
     return pos_layer_dict.get(layer_index)
 
-def get_path(layers,hemi,imp):
-    if layers == [1,2,3]:
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_TESTS_DAMAGE\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [1, 2]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_AND_TESTS\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [1, 3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\TESTS_AND_DAMAGE\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [2, 3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO_AND_DAMAGE\Spearman_Corr_Matrix_{hemi}.csv"
-    elif layers == [1]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\TESTS\Spearman_Corr_Matrix_{hemi}_{imp}.csv"
-    elif layers == [2]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DECO\Spearman_Corr_Matrix_{hemi}.csv"
-    elif layers == [3]: 
-        return rf"{MAIN_PATH}\Coding\Correlation_Matrix\DAMAGE\Spearman_Corr_Matrix_{hemi}.csv"
-    else:
-        print("Error: Wrong layers.")
-        return 0
-
 def get_nodes_from_layers(graph, layers):
     nodes = [node for node, data in graph.nodes(data=True) if data.get('layer') in set(layers)]
     return nodes
@@ -76,184 +75,293 @@ def most_central_edge(G):
     centrality = betweenness(G, weight="weight")
     return max(centrality, key=centrality.get)
 
-def save_multilayers_plots(fig, legend_fig, hemi, imp, label, treshold):
+def get_plot_paths(layers, hemi, imp, treshold):
+    # Output directory, plot and legend file paths, from the data catalog
+    plot_file_path = dc.path("multilayers_plot", layers, hemi, imp, treshold=treshold)
+    legend_file_path = dc.path("multilayers_legend", layers, hemi, imp, treshold=treshold)
+    return os.path.dirname(plot_file_path), plot_file_path, legend_file_path
+
+def save_multilayers_plots(fig, legend_fig, layers, hemi, imp, treshold):
     # Create file if it doesnt exist
-    save_dir = rf"{MAIN_PATH}\Coding\Correlation_matrix\Multilayers_Plots\{treshold}\{hemi}\{label}"
+    save_dir, plot_file_path, legend_file_path = get_plot_paths(layers, hemi, imp, treshold)
     os.makedirs(save_dir, exist_ok=True)
     # Save plot
-    plot_file_path = os.path.join(save_dir, f"Correlationplot_{label}_{hemi}_{imp}.png")
-    fig.savefig(plot_file_path, dpi=300, bbox_inches='tight')
+    with rr.stage("savefig_plot"):
+        fig.savefig(plot_file_path, dpi=300, bbox_inches='tight')
 
     # Save legend
-    legend_file_path = os.path.join(save_dir, f"Correlationlegend_{label}_{hemi}_{imp}.png")
-    legend_fig.savefig(legend_file_path, dpi=300, bbox_inches='tight')
-
-
-def main() : 
-    layers = [1,3]           # [1]  [2]  [3] [1,2]  [1,3]  [2,3]  [1,2,3]   
-
-    label = nm.get_label(layers)
-
-    for treshold in [0.175, 0.229]:    #, 0.229
-        for hemi in ['L', 'R']:
-            for imp in [1, 2, 3, 4, 5,'mean']:                # 1, 2, 3, 4, 5, 
-                # Votre code ici
-
-                                
-                file_path = get_path(layers,hemi,imp)
-                #Checking the file existence
-                if not os.path.exists(file_path):
-                    print(f"File does not exist in : {file_path}")
-                    return 
-                
-                else:
-                    # Read file in dataframe
-                    df = pd.read_csv(file_path, delimiter=';')
-
-                    # Remove case named "Name"
-                    df = df.drop("Name", axis=1)
-
-                    # Graph creation
-                    G = nx.Graph()
-
-                    for node in df.columns:
-                        node_layer = nm.get_layer(node)  # Retrieve the layer for the node
-                        G.add_node(node, layer=nm.get_layer(node))
-                        if node_layer not in layer_colors:
-                            print(f"Warning: No color assigned for layer {node_layer}. Defaulting to grey.")
-
-
-                    ### Adding edges based on correlation values
-                    ### Use a different threshold for interlayer edges and intralayer edges
-                                    # # Negative interval : 
-                    min_neg_tresh = -1
-                    max_neg_tresh = -treshold       # p<0.05 : left : 0.128  #right : 0.154         p<0.01 : left : 0.168  # right : 0.199
-                    # Positive interval :                               # 0.192 tests   0.19 tracts
-                    min_pos__tresh = treshold                # pour 126 patients       p<0.05 : 0.175                p<0.01 : 0.229
-                    max_pos__tresh = 1
-
-                    for j, node1 in enumerate(df.columns):
-                        for k, node2 in enumerate(df.columns):
-                            if j < k:  # To avoid duplicates
-                                weight = df.iloc[j, k]
-                                # Separate the three different edges to be able to each define an interval
-                                                    # Separate the three different edges to be able to each define an interval
-                                if (min_neg_tresh <= weight <= max_neg_tresh or min_pos__tresh <= weight <= max_pos__tresh):
-                                        G.add_edge(node1, node2, weight=weight)
-
-                    label = nm.get_label(layers)
-                    #nodes = get_nodes_from_layers(G,layers)
-
-                    # PLOT : Creating a 3D figure
-                    #pos_xy = nx.spring_layout(G, k=10)
-
-                    #pos_xy = nx.circular_layout(G)
-
-                    layer_positions = {}
-                    for layer in layers:
-                        nodes_in_layer = [n for n in G.nodes if G.nodes[n]['layer'] == layer]
-                        scales = {1: 2, 2: 3, 3: 1}  # Rayon différent pour chaque couche
-                        circular_pos = nx.circular_layout(G.subgraph(nodes_in_layer), scale=scales[layer])
-                        z = get_z_pos(layer)  # Assign the correct Z coordinate
-                        for node, (x, y) in circular_pos.items():
-                            layer_positions[node] = (x, y, z)  # Store 3D positions
-
-                    pos_xy = layer_positions
-
-
-                    #pos_xy = nx.shell_layout(G)
-                    #pos_xy = nx.spectral_layout(G)
-                    #pos_xy = nx.kamada_kawai_layout(G)
-                    #pos_xy = nx.multipartite_layout(G, subset_key="layer", scale=50)
-
-                    #pos_xy = nx.spring_layout(G, k=3)
-                    fig = plt.figure(figsize=(10, 8))
-                    ax = fig.add_subplot(111, projection='3d')
-
-                    # Set axis labels
-                    ax.set_xlabel('X Axis')
-                    ax.set_ylabel('Y Axis')
-                    ax.set_zlabel('Layer')
-
-                    # Remove graduations (ticks)
-                    ax.set_xticks([])  # From X axis
-                    ax.set_yticks([])  # From y axis
-                    ax.set_zticks([])  # From z axis
-
-                    ax.view_init(elev=20, azim=30)  # Change l'angle de vue
-
-                    ## Set title
-                    #plt.title(rf"Correlation_plot_{label}_{hemi}_{imp}")
-
-                    # Dictionary for storing associations between node numbers and names
-                    node_label_mapping = {node: idx+1 for idx, node in enumerate(G.nodes())}
-
-                    # Creating a legend with the names of the nodes and their associated number
-                    legend_elements = []
-
-                    for node in G.nodes():
-                        node_num = node_label_mapping[node]  # The number assigned to the node
-                        node_color = layer_colors.get(G.nodes[node]['layer'], 'grey') # Get the color specific to the node in the graph
-                        legend_elements.append(Line2D([0], [0], marker='o', color='w', markerfacecolor=node_color, markersize=10, label=f"{node_num}: {node}"))
-
-                    # Get nodes z position
-                    pos = {node: (pos_xy.get(node)[0], pos_xy.get(node)[1], get_z_pos(G.nodes[node]['layer'])) for node in G.nodes()}
-                    # Draw a plane for each layer
-                    layer_z_pos = [get_z_pos(i) for i in layers]
-                    draw_planes(pos, layer_z_pos, ax)
-                    # Plot nodes
-                    for node, (x, y, z) in pos.items():
-                        # Retrieve the correct color for each node's layer from layer_colors
-                        node_color = layer_colors.get(G.nodes[node]['layer'], 'grey')
-                        ax.scatter(x, y, z, color=node_color, s=60, zorder=2, edgecolors='black')
-                        ax.text(x, y, z, str(node_label_mapping[node]), fontsize=8, color="black", fontweight = "bold", zorder=70)
-
-                    # Drawing edges
-                    for edge in G.edges():
-                        x = np.array((pos[edge[0]][0], pos[edge[1]][0]))
-                        y = np.array((pos[edge[0]][1], pos[edge[1]][1]))
-                        z = np.array((pos[edge[0]][2], pos[edge[1]][2]))
-                        weight = G.edges[edge]['weight']
-                        # Normalizing weights :
-                        #normalized_weight = max(0.5, min(5, abs(weight) * 2))  # Adjuste 10 factor if you want
-                        # Check if edges connect nodes from different layers
-                        # if G.nodes[edge[0]]['layer'] != G.nodes[edge[1]]['layer']:
-                        #     linestyle = '--'   # Use the dashed line style for inter-layer edges (type, (taille))
-                        # else:
-                        #     linestyle = 'solid'   # Use solid line style for intra-layer edges
-
-                        if weight < 0:
-                            linestyle = '--'
-                        else : 
-                            linestyle = 'solid'       
-
-                        # # Color negative correlations in red and positive ones in black
-                        # if weight < 0:
-                        #     edge_color = "red"
-                        # else : 
-                        #     edge_color = "green"   
-
-                        ax.plot(x, y, z, color='grey', linestyle=linestyle, linewidth = 0.5)      #linewidth = normalized_weight
-
-                        
-                ax.set_axis_off()
-
-                # Create a new figure for the legend
-                legend_fig = plt.figure(figsize=(4, 6))  # Adjust size as needed
-                ax_legend = legend_fig.add_subplot(111)
-
-                # Create a legend with two columns
-                ax_legend.legend(handles=legend_elements, loc='center', title="Node Legend", ncol=2)    #bbox_to_anchor=(1, 0.5)
-
-                # Remove axes from the legend figure
-                ax_legend.axis('off')
-                
+    with rr.stage("savefig_legend"):
+        legend_fig.savefig(legend_file_path, dpi=300, bbox_inches='tight')
+    dc.record(plot_file_path)
+    dc.record(legend_file_path)
+
+
+def edge_intervals(treshold):
+    ### Edges based on correlation values
+    # Negative interval : 
+    min_neg_tresh = -1
+    max_neg_tresh = -treshold       # p<0.05 : left : 0.128  #right : 0.154         p<0.01 : left : 0.168  # right : 0.199
+    # Positive interval :                               # 0.192 tests   0.19 tracts
+    min_pos__tresh = treshold                # pour 126 patients       p<0.05 : 0.175                p<0.01 : 0.229
+    max_pos__tresh = 1
+    return [(min_neg_tresh, max_neg_tresh), (min_pos__tresh, max_pos__tresh)]
+
+def graph_nodes(source):
+    # Graph without edges: one node per variable, with its layer.
+    # The source is a correlation matrix DataFrame or the sparse edge list of the matrix
+    G = nx.Graph()
+    for node in ee.source_names(source):
+        node_layer = nm.get_layer(node)  # Retrieve the layer for the node
+        G.add_node(node, layer=node_layer)
+        if node_layer not in layer_colors:
+            print(f"Warning: No color assigned for layer {node_layer}. Defaulting to grey.")
+    return G
+
+def build_graph(source, treshold, qvalues=None, alpha=None):
+    # Graph of a single threshold
+    G = graph_nodes(source)
+
+    # Upper-triangle edges inside either interval, added in one bulk call.
+    # With permutation q-values, the pairs must also be significant at the FDR level alpha
+    ee.add_source_edges([G], source, edge_intervals(treshold), qvalues=qvalues, alpha=alpha)
+    return G
+
+def get_layer_positions(G, layers):
+    # Circular layout of each layer, with a different radius per layer (node_layout.LAYER_SCALES),
+    # computed once per node set and cached, at the layer z position
+    nodes = [n for n in G.nodes if G.nodes[n]['layer'] in layers]
+    circular_pos = nl.cached_layout(nodes, [G.nodes[n]['layer'] for n in nodes])
+    return {node: (x, y, get_z_pos(G.nodes[node]['layer'])) for node, (x, y) in circular_pos.items()}
+
+def create_template(G, layers):
+    # Everything that only depends on the node set is drawn once: planes, axes, nodes,
+    # node numbers and the legend figure. Only the edges change between plots.
+    pos = get_layer_positions(G, layers)
+
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111, projection='3d')
+
+    # Set axis labels
+    ax.set_xlabel('X Axis')
+    ax.set_ylabel('Y Axis')
+    ax.set_zlabel('Layer')
+
+    # Remove graduations (ticks)
+    ax.set_xticks([])  # From X axis
+    ax.set_yticks([])  # From y axis
+    ax.set_zticks([])  # From z axis
+
+    ax.view_init(elev=20, azim=30)  # Change l'angle de vue
+
+    # Draw a plane for each layer
+    layer_z_pos = [get_z_pos(i) for i in layers]
+    draw_planes(pos, layer_z_pos, ax)
+
+    # Dictionary for storing associations between node numbers and names
+    node_label_mapping = {node: idx+1 for idx, node in enumerate(G.nodes())}
+
+    # Plot nodes: one scatter per layer
+    node_layers = nx.get_node_attributes(G, 'layer')
+    for layer in sorted(set(node_layers.values()), key=str):
+        xyz = np.array([pos[node] for node in G.nodes() if node_layers[node] == layer])
+        ax.scatter(xyz[:, 0], xyz[:, 1], xyz[:, 2], color=layer_colors.get(layer, 'grey'), s=60, zorder=2, edgecolors='black')
+    for node, (x, y, z) in pos.items():
+        ax.text(x, y, z, str(node_label_mapping[node]), fontsize=8, color="black", fontweight = "bold", zorder=70)
+
+    ax.set_axis_off()
+
+    # Creating a legend with the names of the nodes and their associated number
+    legend_elements = []
+    for node in G.nodes():
+        node_num = node_label_mapping[node]  # The number assigned to the node
+        node_color = layer_colors.get(G.nodes[node]['layer'], 'grey') # Get the color specific to the node in the graph
+        legend_elements.append(Line2D([0], [0], marker='o', color='w', markerfacecolor=node_color, markersize=10, label=f"{node_num}: {node}"))
+
+    # Create a new figure for the legend
+    legend_fig = plt.figure(figsize=(4, 6))  # Adjust size as needed
+    ax_legend = legend_fig.add_subplot(111)
+
+    # Create a legend with two columns
+    ax_legend.legend(handles=legend_elements, loc='center', title="Node Legend", ncol=2)    #bbox_to_anchor=(1, 0.5)
+
+    # Remove axes from the legend figure
+    ax_legend.axis('off')
+
+    return {"nodes": list(G.nodes()), "pos": pos, "fig": fig, "ax": ax, "legend_fig": legend_fig, "edges": []}
+
+def draw_edges(template, G):
+    # Replace the edges of the previous plot: all edges in two collections,
+    # solid lines for positive correlations and dashed lines for negative ones
+    for collection in template["edges"]:
+        collection.remove()
+    template["edges"] = []
+
+    pos = template["pos"]
+    edges = list(G.edges(data='weight'))
+    segments = np.array([(pos[node1], pos[node2]) for node1, node2, _ in edges]).reshape(-1, 2, 3)
+    weights = np.array([weight for _, _, weight in edges])
+    for is_negative, linestyle in [(False, 'solid'), (True, '--')]:
+        selected = segments[(weights < 0) == is_negative]
+        if len(selected):
+            collection = Line3DCollection(selected, colors='grey', linestyles=linestyle, linewidths=0.5)
+            template["ax"].add_collection3d(collection)
+            template["edges"].append(collection)
+
+def close_template(template):
+    # Release the figures of a template
+    if template is not None:
+        plt.close(template["fig"])
+        plt.close(template["legend_fig"])
+
+def list_render_jobs(layers_list, tresholds, hemis, imps):
+    # Every (layers, treshold, hemi, imp) plot, grouped by (layers, hemi): the plots of a group
+    # share their node set, so each group reuses one figure template
+    units = []
+    for layers in layers_list:
+        for hemi in hemis:
+            units.append([(layers, treshold, hemi, imp) for treshold in tresholds for imp in imps])
+    return units
+
+def render_unit(unit_jobs, alpha=None):
+    # Render the plots of a unit. Missing inputs are reported and skipped.
+    # With alpha, edges also need an FDR q-value <= alpha.
+    # Every matrix is read once for all its thresholds: its graph is grown from the highest threshold
+    # to the lowest by adding the new edges (threshold_sweep.sweep_graphs) instead of being rebuilt.
+    # Returns the (job, seconds) timings of the rendered plots and the log lines.
+    plt.switch_backend("Agg")
+    template = None
+    timings = []
+    log = []
+    matrix_tresholds = {}
+    for layers, treshold, hemi, imp in unit_jobs:
+        matrix_tresholds.setdefault((tuple(layers), hemi, imp), []).append(treshold)
+
+    for (layers, hemi, imp), tresholds in matrix_tresholds.items():
+        layers = list(layers)
+        start = time.perf_counter()
+        file_path = dc.path("correlation", layers, hemi, imp)
+        #Checking the file existence
+        if not ms.matrix_exists(file_path):
+            log.append(f"File does not exist in : {file_path}")
+            continue
+
+        qvalues = None
+        if alpha is not None:
+            qvalues = ps.load_qvalues(file_path)
+            if qvalues is None:
+                log.append(f"No q-values for : {file_path}")
+                continue
+
+        graphs = None
+        for treshold in sorted(tresholds, reverse=True):
+            with rr.job(f"layers:{nm.get_label(layers)};treshold:{ee.treshold_key(treshold, alpha)};hemi:{hemi};imp:{imp}"):
+                if graphs is None:
+                    # Read the sparse edge list when it holds every edge of the lowest threshold, the matrix otherwise
+                    # (memory-mapped binary if available, CSV without its "Name" column otherwise)
+                    with rr.stage("load_matrix"):
+                        source = ee.load_source(file_path, edge_intervals(min(tresholds)))
+                    graphs = ts.sweep_graphs(graph_nodes(source), source, tresholds, qvalues=qvalues, alpha=alpha)
+                with rr.stage("build_graph"):
+                    _, G = next(graphs)
+                rr.note(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+
+                # PLOT : build the 3D figure once per node set, then only swap the edges
+                if template is None or template["nodes"] != list(G.nodes()):
+                    close_template(template)
+                    with rr.stage("create_template"):
+                        template = create_template(G, layers)
+                with rr.stage("draw_edges"):
+                    draw_edges(template, G)
 
                 # Save multilayers plots
-                save_multilayers_plots(fig, legend_fig, hemi, imp, label, treshold)
+                save_multilayers_plots(template["fig"], template["legend_fig"], layers, hemi, imp, ee.treshold_key(treshold, alpha))
+            timings.append(((layers, treshold, hemi, imp), time.perf_counter() - start))
+            start = time.perf_counter()
+
+            # # # Display graph
+            # plt.show() 
+
+    close_template(template)
+    return timings, log
+
+def get_render_io(job, alpha=None):
+    # Outputs, inputs and parameters of a plot, as recorded in the build manifest
+    layers, treshold, hemi, imp = job
+    _, plot_file_path, legend_file_path = get_plot_paths(layers, hemi, imp, ee.treshold_key(treshold, alpha))
+    file_path = dc.path("correlation", layers, hemi, imp)
+    inputs = ee.source_files(file_path, edge_intervals(treshold))
+    if alpha is not None:
+        inputs = inputs + ms.matrix_files(ps.significance_paths(file_path)[1])
+    params = {"layers": layers, "treshold": treshold, "alpha": alpha, "hemi": hemi, "imp": imp}
+    return [plot_file_path, legend_file_path], inputs, params
+
+def main(layers_list=None, tresholds=None, hemis=None, imps=None, workers=1, force=False, alpha=None) : 
+    # Defaults: layers [1]=NT and [3]=CD, the p<0.05 and p<0.01 thresholds for 126 patients, both hemispheres, every imputation
+    if layers_list is None:
+        layers_list = [[1, 3]]
+    if tresholds is None:
+        tresholds = [0.175, 0.229]
+    if hemis is None:
+        hemis = ['L', 'R']
+    if imps is None:
+        imps = [1, 2, 3, 4, 5, 'mean']
+    # Skip the plots built from the same matrix, parameters and code
+    manifest = bm.BuildManifest(dc.path("multilayers_manifest"), force=force)
+    code = bm.code_version(__file__, ee, ms, ps, nl, ts)
+
+    units = []
+    for unit_jobs in list_render_jobs(layers_list, tresholds, hemis, imps):
+        pending = [job for job in unit_jobs
+                   if not ms.matrix_exists(dc.path("correlation", job[0], job[2], job[3])) or not manifest.is_up_to_date(*get_render_io(job, alpha), code)]
+        if pending:
+            units.append(pending)
+
+    # Print the logs of the rendered units in unit order and record their plots, the manifest being saved
+    # after every unit so that a failing unit keeps the plots already rendered
+    timings = []
+    def collect(results):
+        for unit_timings, log in results:
+            for line in log:
+                print(line)
+            for job, seconds in unit_timings:
+                manifest.record(*get_render_io(job, alpha), code)
+            manifest.save()
+            timings.extend(unit_timings)
+
+    # Render the units in this process or on a process pool, shut down even when a unit fails
+    start = time.perf_counter()
+    render = partial(render_unit, alpha=alpha)
+    if workers == 1:
+        collect(map(render, units))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            collect(executor.map(render, units))
 
-                # # # Display graph
-                # plt.show() 
+    print(f"{len(timings)} plots rendered in {time.perf_counter() - start:.1f}s")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="3D multilayer plots of the correlation networks.")
+    parser.add_argument("--layers", nargs='+', default=["1,3"],
+                        help="Layer combinations, e.g. 1 2,3 1,2,3, or 'all' for the seven combinations")
+    parser.add_argument("--tresholds", type=float, nargs='+', default=[0.175, 0.229],
+                        help="Correlation thresholds (0 keeps every significant pair with --alpha)")
+    parser.add_argument("--alpha", type=float, default=None,
+                        help="Also require an FDR q-value <= alpha (q-value matrices of Correlation_Matrix_Creation --permutations)")
+    parser.add_argument("--hemis", nargs='+', default=['L', 'R'], help="Hemispheres")
+    parser.add_argument("--imps", nargs='+', default=['1', '2', '3', '4', '5', 'mean'], help="Imputations")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (0 = one per CPU core)")
+    parser.add_argument("--force", action="store_true", help="Rebuild every plot, even those that are up to date")
+    rr.add_arguments(parser)
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    rr.start_from_args("Multilayers_Plots", args)
+    dc.start_from_args(args, CATALOG_STAGES)
+
+    if args.layers == ["all"]:
+        layers_list = ALL_LAYERS
+    else:
+        layers_list = [[int(layer) for layer in layers.split(',')] for layers in args.layers]
+    imps = [int(imp) if imp.isdigit() else imp for imp in args.imps]
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    main(layers_list, args.tresholds, args.hemis, imps, workers, args.force, args.alpha)
+    rr.finish()
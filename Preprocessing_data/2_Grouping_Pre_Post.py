@@ -1,52 +1,56 @@
 from my_globals import *
-import pandas as pd
-import os
-import numpy as np
-from sklearn.preprocessing import StandardScaler
-
-# List of cognitive test names
-test_name = ["LB", "BELLS", "CODES", "DO80", "DS_F", "DS_B", "FIG_C", "FIG_R", 
-             "FLU_A", "FLU_P", "PPTT", "RLRI_E", "RLRI_FR", "RLRI_TR", 
-             "STROOP_D", "STROOP_R", "STROOP_ID", "TMT_A", "TMT_BA"]
-
-# Hemispheres
-hemisphere = ["L", "R"]
-
-# List of imputation indexes
-imp = [1, 2, 3, 4, 5]
+import argparse
+from preprocessing_steps import (test_name, hemisphere, imp, imputation_paths, grouping_path, group_pre_post, save_step,
+                                 preprocessing_manifest, preprocessing_code_version, PREPROCESSING_STAGES)
+import run_report as rr
+import prefetch_loader as pl
+import data_catalog as dc
+
+parser = argparse.ArgumentParser(description="Step 2: group the Pre and Post_3M imputed scores.")
+parser.add_argument("--force", action="store_true", help="Rebuild every file, even those that are up to date")
+pl.add_arguments(parser)
+rr.add_arguments(parser)
+dc.add_arguments(parser)
+args = parser.parse_args()
+rr.start_from_args("2_Grouping_Pre_Post", args)
+dc.start_from_args(args, PREPROCESSING_STAGES)
+
+manifest = preprocessing_manifest(args.force)
+code = preprocessing_code_version(__file__)
 
 # Loop through all combinations of test, hemisphere, and imputation index
+jobs = []
 for test in test_name:
     for hemi in hemisphere:
         for i in imp:
             # Define the file paths for the Pre and Post_3M imputation files
-            file_path_1 = rf"{MAIN_PATH}\Données\TESTS\0_AFTER_IMPUTATIONS\pmm\{hemi}\{test}\Pre\IMPUTATION_{test}_{i}.csv"
-            file_path_2 = rf"{MAIN_PATH}\Données\TESTS\0_AFTER_IMPUTATIONS\pmm\{hemi}\{test}\Post_3M\IMPUTATION_{test}_{i}.csv"
-
-            # Check if the Pre file exists
-            if not os.path.exists(file_path_1):
-                print(f"File does not exist for {test}, {hemi}, {i}.")
-            else:
-                # Read the Pre file into a DataFrame
-                df_Pre = pd.read_csv(file_path_1, delimiter=';')
-
-            # Check if the Post_3M file exists
-            if not os.path.exists(file_path_2):
-                print(f"File does not exist for {test}, {hemi}, {i}.")
-            else:
-                # Read the Post_3M file into a DataFrame
-                df_Post_3M = pd.read_csv(file_path_2, delimiter=';')
-
-                # Extract the fourth column from the Post_3M DataFrame
-                col_to_add = df_Post_3M.iloc[:, 3]
-
-                # Add the extracted column to the Pre DataFrame
-                df_Pre[f'{test}_Post_3M'] = col_to_add
-
-                # Define the output directory and file path
-                dir = rf"{MAIN_PATH}\Données\TESTS\1_GROUPING_PRE_POST\PRE_POST_{hemi}\{test}"
-                path_destination = dir + rf"\Pre_Post_{test}_{i}.csv"
-                os.makedirs(dir, exist_ok=True)
-
-                # Save the updated DataFrame to the new CSV file
-                df_Pre.to_csv(path_destination, sep=';', index=False)
+            file_path_1, file_path_2 = imputation_paths(test, hemi, i)
+            dir, path_destination = grouping_path(test, hemi, i)
+            params = {"step": 2, "test": test, "hemi": hemi, "imp": i}
+
+            # Skip the outputs built from the same inputs and code
+            if manifest.is_up_to_date(path_destination, [file_path_1, file_path_2], params, code):
+                continue
+            jobs.append((test, hemi, i, file_path_1, file_path_2, dir, path_destination, params))
+
+# The Pre and Post_3M files are read ahead on a thread pool while the previous files are grouped and saved
+frames = pl.prefetch_groups([(file_path_1, file_path_2) for _, _, _, file_path_1, file_path_2, _, _, _ in jobs],
+                            args.prefetch, args.csv_engine)
+for (test, hemi, i, file_path_1, file_path_2, dir, path_destination, params), (df_Pre, df_Post_3M) in zip(jobs, frames):
+    with rr.job(f"test:{test};hemi:{hemi};imp:{i}"):
+        # Check if the Pre and Post_3M files exist
+        if df_Pre is None:
+            print(f"File does not exist for {test}, {hemi}, {i}.")
+        if df_Post_3M is None:
+            print(f"File does not exist for {test}, {hemi}, {i}.")
+        if df_Pre is not None and df_Post_3M is not None:
+            # Add the Post_3M score to the Pre DataFrame
+            with rr.stage("group"):
+                df_Pre = group_pre_post(df_Pre, df_Post_3M, test)
+
+            # Save the updated DataFrame to the new CSV file
+            save_step(df_Pre, dir, path_destination)
+            manifest.record(path_destination, [file_path_1, file_path_2], params, code)
+
+manifest.save()
+rr.finish()
@@ -1,66 +1,64 @@
 from my_globals import *
-import pandas as pd
-import os
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import StandardScaler
-import numpy as np
+import argparse
+from preprocessing_steps import (test_name, hemisphere, imp, deficit_path, regression_path, regression_residuals,
+                                 batched_regression_residuals, save_step, preprocessing_manifest,
+                                 preprocessing_code_version, PREPROCESSING_STAGES)
+import run_report as rr
+import prefetch_loader as pl
+import data_catalog as dc
 
-# Initialize variable lists
-test_name = ["LB", "BELLS", "CODES", "DO80", "DS_F", "DS_B", "FIG_C", "FIG_R", "FLU_A", "FLU_P", "PPTT", "RLRI_E", "RLRI_FR", "RLRI_TR", "STROOP_D", "STROOP_R", "STROOP_ID", "TMT_A", "TMT_BA"]
-hemisphere = ["L", "R"]
-longitude = ["Pre", "Post_3M"]
-imp = [1, 2, 3, 4, 5]
+parser = argparse.ArgumentParser(description="Step 4: normalized residuals of every test regressed on AGE and NSE.")
+parser.add_argument("--batched", action="store_true",
+                    help="One least-squares fit per distinct AGE/NSE design instead of one sklearn LinearRegression "
+                         "per file (faster, equal to the default outputs up to ~1e-15, not bit for bit)")
+parser.add_argument("--force", action="store_true", help="Rebuild every file, even those that are up to date")
+pl.add_arguments(parser)
+rr.add_arguments(parser)
+dc.add_arguments(parser)
+args = parser.parse_args()
+rr.start_from_args("4_Reg_Lin_Multiple", args)
+dc.start_from_args(args, PREPROCESSING_STAGES)
 
-# Loop through all combinations of test names, hemispheres, time points, and imputations
+manifest = preprocessing_manifest(args.force)
+code = preprocessing_code_version(__file__)
+
+# Load every deficit percentage file (the residuals do not depend on the time point,
+# so each test/hemisphere/imputation is computed once)
+inputs = []
+destinations = []
+records = []
 for test in test_name:
     for hemi in hemisphere:
-        for longit in longitude:
-            for i in imp:
-                X_data = []
-                y_data = []
-                
-
-                # For deficit percentage data
-                file_path = rf"{MAIN_PATH}\Données\TESTS\2_DEFICIT_PERCENTAGE_DATA\{hemi}_DEFICIT_PERCENTAGE_DATA\{test}\Deficit_Percentage_{test}_{i}.csv"
-
-                # Check if the file exists
-                if not os.path.exists(file_path):
-                    print(f"File does not exist for {test}, {hemi}, {i}.")
-                else:
-                    # Load the data into a DataFrame
-                    df = pd.read_csv(file_path, delimiter=';')
-
-                    # Define predictors (AGE and NSE) and target variable (test score)
-                    X_data = df[['AGE', 'NSE']]
-                    y_data = df[f"{test}"]
-
-                    # Create and fit the linear regression model
-                    model = LinearRegression()
-                    model.fit(X_data, y_data)
-
-                    # Predict the target variable
-                    y_pred = model.predict(X_data)
-
-                    # Compute residuals (difference between actual and predicted values)
-                    residuals = y_data - y_pred
-
-                    # Normalize the residuals using StandardScaler
-                    scaler = StandardScaler()
-                    residuals_array = np.array(residuals)  # Convert to NumPy array
-                    residuals_normalized = scaler.fit_transform(residuals_array.reshape(-1, 1))
+        for i in imp:
+            _, file_path = deficit_path(test, hemi, i)
 
-                    # Store the normalized residuals in a DataFrame
-                    residuals_df = pd.DataFrame({rf'{test}_{hemi}': residuals_normalized.squeeze()})
+            dir, path_destination = regression_path(test, hemi, i)
+            params = {"step": 4, "test": test, "hemi": hemi, "imp": i, "batched": args.batched}
 
-                    # Define the destination directory and file path
-                    dir = rf"{MAIN_PATH}\Données\TESTS\3_REG_MUL_DATA\{hemi}_REG_DATA\{test}"
-                    path_destination = dir + rf"\Reg_Lin_{test}_{i}.csv"
+            # Check if the file exists
+            if not dc.exists(file_path):
+                print(f"File does not exist for {test}, {hemi}, {i}.")
+            elif not manifest.is_up_to_date(path_destination, [file_path], params, code):
+                inputs.append((file_path, test, hemi))
+                destinations.append((dir, path_destination))
+                records.append((path_destination, [file_path], params))
 
-                    # Create the destination directory if it doesn't exist
-                    os.makedirs(dir, exist_ok=True)
+# Load the data into DataFrames, the files being read concurrently on a thread pool
+frames = pl.prefetch_csv([file_path for file_path, _, _ in inputs], args.prefetch, args.csv_engine)
+targets = [(df, test, hemi) for (_, df), (_, test, hemi) in zip(frames, inputs)]
 
-                    # Save the residuals to a CSV file
-                    residuals_df.to_csv(path_destination, sep=';', index=False)
+# Normalized residuals of the tests regressed on AGE and NSE, one fit per file or per distinct AGE/NSE design
+with rr.job("regression_residuals", files=len(targets), batched=args.batched):
+    with rr.stage("regression"):
+        if args.batched:
+            residuals = batched_regression_residuals(targets)
+        else:
+            residuals = [regression_residuals(df, test, hemi) for df, test, hemi in targets]
 
-                    # Optional: print confirmation message
-                    # print("Normalized residuals saved successfully.")
+    # Save the residuals to their CSV files
+    for residuals_df, (dir, path_destination) in zip(residuals, destinations):
+        save_step(residuals_df, dir, path_destination)
+for path_destination, inputs, params in records:
+    manifest.record(path_destination, inputs, params, code)
+manifest.save()
+rr.finish()
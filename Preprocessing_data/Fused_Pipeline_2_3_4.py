@@ -0,0 +1,83 @@
+from my_globals import *
+import argparse
+from preprocessing_steps import (test_name, hemisphere, imp, imputation_paths, grouping_path, deficit_path,
+                                 regression_path, group_pre_post, deficit_percentage, regression_residuals,
+                                 batched_regression_residuals, save_step, preprocessing_manifest,
+                                 preprocessing_code_version, PREPROCESSING_STAGES)
+import run_report as rr
+import prefetch_loader as pl
+import data_catalog as dc
+
+# Run steps 2 (grouping), 3 (deficit percentage) and 4 (regression residuals) in memory:
+# the imputed Pre/Post_3M files are read once and only the 3_REG_MUL_DATA outputs are written.
+# The intermediates are rounded exactly like their CSV files, so the outputs match the step by step scripts.
+# Imputed files are read ahead on a thread pool while the previous ones are processed, and step 4 runs once
+# on all the deficits (batched by AGE/NSE design with --batched).
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fused preprocessing steps 2 -> 3 -> 4.")
+    parser.add_argument("--write-intermediates", action="store_true",
+                        help="Also write the 1_GROUPING_PRE_POST and 2_DEFICIT_PERCENTAGE_DATA files, for audit")
+    parser.add_argument("--batched", action="store_true",
+                        help="One least-squares fit per distinct AGE/NSE design instead of one sklearn "
+                             "LinearRegression per file (faster, equal up to ~1e-15, not bit for bit)")
+    parser.add_argument("--force", action="store_true", help="Rebuild every file, even those that are up to date")
+    pl.add_arguments(parser)
+    rr.add_arguments(parser)
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    rr.start_from_args("Fused_Pipeline_2_3_4", args)
+    dc.start_from_args(args, PREPROCESSING_STAGES)
+
+    manifest = preprocessing_manifest(args.force)
+    code = preprocessing_code_version(__file__)
+
+    jobs = []
+    targets = []
+    destinations = []
+    records = []
+
+    for test in test_name:
+        for hemi in hemisphere:
+            for i in imp:
+                file_path_1, file_path_2 = imputation_paths(test, hemi, i)
+                if not dc.exists(file_path_1) or not dc.exists(file_path_2):
+                    print(f"File does not exist for {test}, {hemi}, {i}.")
+                    continue
+
+                outputs = [regression_path(test, hemi, i)[1]]
+                if args.write_intermediates:
+                    outputs += [grouping_path(test, hemi, i)[1], deficit_path(test, hemi, i)[1]]
+                params = {"step": "2-3-4", "test": test, "hemi": hemi, "imp": i, "batched": args.batched}
+                if not manifest.is_up_to_date(outputs, [file_path_1, file_path_2], params, code):
+                    jobs.append((test, hemi, i, file_path_1, file_path_2, outputs, params))
+
+    frames = pl.prefetch_groups([(file_path_1, file_path_2) for _, _, _, file_path_1, file_path_2, _, _ in jobs],
+                                args.prefetch, args.csv_engine)
+    for (test, hemi, i, file_path_1, file_path_2, outputs, params), (df_Pre, df_Post_3M) in zip(jobs, frames):
+        with rr.job(f"test:{test};hemi:{hemi};imp:{i}"):
+            # Step 2: group Pre and Post_3M scores
+            with rr.stage("group_and_deficit"):
+                df_grouped = group_pre_post(df_Pre, df_Post_3M, test)
+                # Step 3: deficit (rounded to 3 decimals like the step 3 files)
+                df_deficit = deficit_percentage(df_grouped, test)
+
+            if args.write_intermediates:
+                save_step(df_grouped, *grouping_path(test, hemi, i))
+                save_step(df_deficit, *deficit_path(test, hemi, i))
+            targets.append((df_deficit, test, hemi))
+            destinations.append(regression_path(test, hemi, i))
+            records.append((outputs, [file_path_1, file_path_2], params))
+
+    # Step 4: normalized residuals, one fit per file or batched over the targets sharing the same AGE/NSE design
+    with rr.job("regression_residuals", files=len(targets), batched=args.batched):
+        with rr.stage("regression"):
+            if args.batched:
+                residuals = batched_regression_residuals(targets)
+            else:
+                residuals = [regression_residuals(df, test, hemi) for df, test, hemi in targets]
+        for residuals_df, (dir, path_destination) in zip(residuals, destinations):
+            save_step(residuals_df, dir, path_destination)
+    for outputs, inputs, params in records:
+        manifest.record(outputs, inputs, params, code)
+    manifest.save()
+    rr.finish()
@@ -0,0 +1,208 @@
+from my_globals import *
+import pandas as pd
+import os
+import sys
+import numpy as np
+import hashlib
+# Modules shared with the network scripts live in the parent directory
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import build_manifest as bm
+import run_report as rr
+import data_catalog as dc
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+# Deficit formulas, from the Pre and Post_3M scores (Series or arrays)
+DEFICIT_FORMULAS = {
+    # Percentage of performance decrease (higher score = better performance)
+    "percent_decrease": lambda pre, post: (-(post - pre) / pre) * 100,
+    # Percentage of performance increase (higher score = worse performance)
+    "percent_increase": lambda pre, post: ((post - pre) / pre) * 100,
+    # Lateralized test: directional difference, deficit = deviation toward the left
+    "left_deviation": lambda pre, post: -(pre - post),
+    # Lateralized test: directional difference, deficit = deviation toward the left (non-inverted)
+    "left_deviation_direct": lambda pre, post: (post - pre)
+}
+
+# Deficit formula of every cognitive test, based on how its performance is interpreted.
+# Adding a test only needs a new entry here.
+DEFICIT_TRANSFORMS = {
+    "LB": "left_deviation",
+    "BELLS": "left_deviation_direct",
+    "CODES": "percent_decrease",
+    "DO80": "percent_decrease",
+    "DS_F": "percent_decrease",
+    "DS_B": "percent_decrease",
+    "FIG_C": "percent_decrease",
+    "FIG_R": "percent_decrease",
+    "FLU_A": "percent_decrease",
+    "FLU_P": "percent_decrease",
+    "PPTT": "percent_decrease",
+    "RLRI_E": "percent_decrease",
+    "RLRI_FR": "percent_decrease",
+    "RLRI_TR": "percent_decrease",
+    "STROOP_D": "percent_increase",
+    "STROOP_R": "percent_increase",
+    "STROOP_ID": "percent_increase",
+    "TMT_A": "percent_increase",
+    "TMT_BA": "percent_increase"
+}
+
+# List of cognitive test names
+test_name = list(DEFICIT_TRANSFORMS)
+
+# Test categories based on how performance is interpreted
+test_name_dir = [test for test, formula in DEFICIT_TRANSFORMS.items() if formula == "percent_decrease"]  # Higher score = better performance
+test_name_inv = [test for test, formula in DEFICIT_TRANSFORMS.items() if formula == "percent_increase"]  # Higher score = worse performance
+test_name_biss = [test for test, formula in DEFICIT_TRANSFORMS.items() if formula == "left_deviation"]  # Lateralized test: deficit = deviation toward the left
+test_name_cloches = [test for test, formula in DEFICIT_TRANSFORMS.items() if formula == "left_deviation_direct"]  # Lateralized test (non-inverted)
+
+# Hemispheres
+hemisphere = ["L", "R"]
+
+# Stages of the data catalog read and written by the preprocessing steps
+PREPROCESSING_STAGES = ["imputation_pre", "imputation_post", "grouping", "deficit", "regression"]
+
+# List of imputation indexes
+imp = [1, 2, 3, 4, 5]
+
+
+# Paths of the imputed Pre and Post_3M files (step 1 outputs)
+def imputation_paths(test, hemi, i):
+    return dc.path("imputation_pre", hemi=hemi, imp=i, test=test), dc.path("imputation_post", hemi=hemi, imp=i, test=test)
+
+# Output directory and path of the file of a step, from the data catalog
+def step_path(stage, test, hemi, i):
+    path = dc.path(stage, hemi=hemi, imp=i, test=test)
+    return os.path.dirname(path), path
+
+# Output directory and path of the grouped Pre/Post file (step 2)
+def grouping_path(test, hemi, i):
+    return step_path("grouping", test, hemi, i)
+
+# Output directory and path of the deficit percentage file (step 3)
+def deficit_path(test, hemi, i):
+    return step_path("deficit", test, hemi, i)
+
+# Output directory and path of the regression residuals file (step 4)
+def regression_path(test, hemi, i):
+    return step_path("regression", test, hemi, i)
+
+# Manifest of the preprocessing outputs, used to skip the files whose inputs and code are unchanged
+def preprocessing_manifest(force=False):
+    return bm.BuildManifest(dc.path("preprocessing_manifest"), force=force)
+
+# Code version of a preprocessing script: the script itself and this module
+def preprocessing_code_version(script_path):
+    return bm.code_version(script_path, __file__)
+
+# Save a step output, creating its directory if needed
+def save_step(df, dir, path_destination):
+    with rr.stage("write_csv"):
+        os.makedirs(dir, exist_ok=True)
+        df.to_csv(path_destination, sep=';', index=False)
+    dc.record(path_destination)
+
+# Step 2: add the Post_3M score (fourth column of the Post_3M file) to the Pre DataFrame
+def group_pre_post(df_Pre, df_Post_3M, test):
+    df_Pre = df_Pre.copy()
+    df_Pre[f'{test}_Post_3M'] = df_Post_3M.iloc[:, 3]
+    return df_Pre
+
+# Deficit formula of a test
+def deficit_formula(test):
+    if test not in DEFICIT_TRANSFORMS:
+        raise ValueError(f"Unknown test: {test}")
+    return DEFICIT_FORMULAS[DEFICIT_TRANSFORMS[test]]
+
+# Step 3: compute the deficit of a test from its Pre and Post_3M scores, rounded to 3 decimals
+def deficit_percentage(df, test):
+    df = df.copy()
+    df[f'{test}'] = deficit_formula(test)(df[f'{test}_Pre'], df[f'{test}_Post_3M'])
+    return df.round(3)
+
+# Batched step 3: sources is a list of (df, test). The Pre/Post_3M scores of every source are stacked in one
+# long frame (one row per patient, test, hemisphere and imputation) and each formula of the registry runs once
+# on all the rows using it. Returns the deficit DataFrames in the order of the sources, identical to deficit_percentage.
+def batched_deficit_percentage(sources):
+    if not sources:
+        return []
+    # Unknown tests raise before anything is computed
+    for _, test in sources:
+        deficit_formula(test)
+    long = pd.concat([pd.DataFrame({"source": index, "formula": DEFICIT_TRANSFORMS[test],
+                                    "Pre": df[f'{test}_Pre'].to_numpy(dtype=np.float64),
+                                    "Post_3M": df[f'{test}_Post_3M'].to_numpy(dtype=np.float64)})
+                      for index, (df, test) in enumerate(sources)], ignore_index=True)
+
+    deficit = np.full(len(long), np.nan)
+    pre = long["Pre"].to_numpy()
+    post = long["Post_3M"].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for name, formula in DEFICIT_FORMULAS.items():
+            rows = (long["formula"] == name).to_numpy()
+            if rows.any():
+                deficit[rows] = formula(pre[rows], post[rows])
+
+    results = []
+    bounds = np.searchsorted(long["source"].to_numpy(), np.arange(len(sources) + 1))
+    for index, (df, test) in enumerate(sources):
+        df = df.copy()
+        values = deficit[bounds[index]:bounds[index + 1]]
+        # Same dtype as the per-file formula, e.g. integer differences of integer scores
+        dtype = deficit_formula(test)(df[f'{test}_Pre'].iloc[:0], df[f'{test}_Post_3M'].iloc[:0]).dtype
+        df[f'{test}'] = pd.Series(values, index=df.index).astype(dtype)
+        results.append(df.round(3))
+    return results
+
+# Step 4: residuals of the test deficit regressed on AGE and NSE, normalized with a StandardScaler
+def regression_residuals(df, test, hemi):
+    # Define predictors (AGE and NSE) and target variable (test score)
+    X_data = df[['AGE', 'NSE']]
+    y_data = df[f"{test}"]
+
+    # Fit the linear regression model and compute residuals
+    model = LinearRegression()
+    model.fit(X_data, y_data)
+    residuals = y_data - model.predict(X_data)
+
+    # Normalize the residuals
+    scaler = StandardScaler()
+    residuals_normalized = scaler.fit_transform(np.array(residuals).reshape(-1, 1))
+    return pd.DataFrame({rf'{test}_{hemi}': residuals_normalized.squeeze()})
+
+# Batched step 4: targets is a list of (df, test, hemi). Every target whose AGE/NSE design is identical
+# is stacked as a column of one Y matrix and solved with a single least-squares factorization, the
+# residuals are z-scored column-wise (population std, like StandardScaler). Each distinct design is
+# fitted once. Returns the residual DataFrames in the order of the targets. The values equal those of
+# regression_residuals up to floating point rounding (~1e-15), not bit for bit.
+def batched_regression_residuals(targets):
+    designs = {}
+    for index, (df, test, hemi) in enumerate(targets):
+        X_data = df[['AGE', 'NSE']].to_numpy(dtype=np.float64)
+        key = hashlib.sha1(np.ascontiguousarray(X_data).tobytes()).hexdigest() + str(X_data.shape)
+        designs.setdefault(key, (X_data, []))[1].append(index)
+
+    results = [None] * len(targets)
+    for X_data, indexes in designs.values():
+        Y_data = np.column_stack([targets[index][0][f"{targets[index][1]}"].to_numpy(dtype=np.float64) for index in indexes])
+
+        # Same centering as LinearRegression: fit on centered data, intercept from the means
+        X_offset = X_data.mean(axis=0)
+        Y_offset = Y_data.mean(axis=0)
+        coef, _, _, _ = np.linalg.lstsq(X_data - X_offset, Y_data - Y_offset, rcond=None)
+        intercept = Y_offset - X_offset @ coef
+        residuals = Y_data - (X_data @ coef + intercept)
+
+        # Same normalization as StandardScaler, including its rule for (near) constant columns
+        mean = residuals.mean(axis=0)
+        var = residuals.var(axis=0)
+        eps = np.finfo(np.float64).eps
+        constant = var <= len(residuals) * eps * var + (len(residuals) * mean * eps) ** 2
+        scale = np.where(constant, 1, np.sqrt(var))
+        residuals_normalized = (residuals - mean) / scale
+
+        for column, index in enumerate(indexes):
+            _, test, hemi = targets[index]
+            results[index] = pd.DataFrame({rf'{test}_{hemi}': residuals_normalized[:, column]})
+    return results
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import data_catalog as dc
+
+
+# Content hash of a file
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Version of the code producing an output: hash of the source files it depends on
+# (modules or paths), so that editing any of them rebuilds its outputs
+def code_version(*sources):
+    digest = hashlib.sha1()
+    for source in sources:
+        path = source if isinstance(source, str) else source.__file__
+        digest.update(file_hash(path).encode('ascii'))
+    return digest.hexdigest()
+
+
+# Make-like record of how every output was built: the content hash of each of its inputs,
+# its parameters and the code version. An output is up to date when it exists and all three
+# are unchanged. Input hashes are reused while the file size and modification time do not change,
+# so unchanged inputs are not read again. Existence, sizes and times come from the data catalog.
+class BuildManifest:
+
+    def __init__(self, manifest_path, force=False):
+        self.manifest_path = manifest_path
+        self.force = force
+        self.entries = {}
+        self.hashes = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                content = json.load(f)
+            self.entries = content.get("outputs", {})
+            self.hashes = content.get("inputs", {})
+
+    # Content hash of an input, None when it does not exist
+    def input_hash(self, path):
+        stat = dc.stat(path)
+        if stat is None:
+            return None
+        size, mtime = stat
+        known = self.hashes.get(path)
+        if known is not None and known["size"] == size and known["mtime"] == mtime:
+            return known["hash"]
+        digest = file_hash(path)
+        self.hashes[path] = {"size": size, "mtime": mtime, "hash": digest}
+        return digest
+
+    # What an output depends on, in a form that can be compared with the manifest
+    def describe(self, inputs, params, code):
+        return {
+            "inputs": {path: self.input_hash(path) for path in sorted(inputs)},
+            "params": json.loads(json.dumps(params or {}, sort_keys=True, default=str)),
+            "code": code
+        }
+
+    # True when every output exists and was built from the same inputs, parameters and code
+    def is_up_to_date(self, outputs, inputs, params=None, code=None):
+        if self.force:
+            return False
+        outputs = [outputs] if isinstance(outputs, str) else outputs
+        description = self.describe(inputs, params, code)
+        if None in description["inputs"].values():
+            return False
+        return all(dc.exists(output) and self.entries.get(output) == description for output in outputs)
+
+    # Record how the outputs were just built
+    def record(self, outputs, inputs, params=None, code=None):
+        outputs = [outputs] if isinstance(outputs, str) else outputs
+        description = self.describe(inputs, params, code)
+        for output in outputs:
+            self.entries[output] = description
+
+    # Write the manifest, through a temporary file renamed into place
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"outputs": self.entries, "inputs": self.hashes}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
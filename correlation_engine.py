@@ -0,0 +1,246 @@
+import time
+from functools import partial
+import tracemalloc
+import numpy as np
+import pandas as pd
+import matrix_storage as ms
+
+# Engines available to compute the Spearman correlation matrices
+ENGINES = ["pandas", "blas"]
+
+# Out-of-core engine for very wide data: the matrix is written tile by tile to disk, never held in memory
+TILED_ENGINE = "tiled"
+
+# Default memory budget (bytes) of the tiles of the tiled engine
+DEFAULT_TILE_BUDGET = 256 * 2**20
+
+# Pairwise-complete engine: pairs of columns a ranking over a set of common rows must serve to beat
+# the per-pair path of pandas
+PAIRS_PER_RANKING = 8
+
+
+# Rank every column once (average ranks for ties, like pandas) and scale the centered ranks
+# to unit norm, so that the Spearman matrix is simply Z.T @ Z
+def standardized_ranks(values, dtype=np.float64):
+    ranks = pd.DataFrame(values).rank(method='average').to_numpy(dtype=np.float64, copy=True)
+    ranks -= ranks.mean(axis=0)
+    norms = np.sqrt(np.einsum('ij,ij->j', ranks, ranks))
+    # Constant columns have no defined correlation, pandas returns NaN for them
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ranks /= norms
+    ranks[:, norms == 0] = np.nan
+    return ranks.astype(dtype, copy=False)
+
+
+# Standardized ranks of every column, ranked block of columns by block of columns so that the
+# ranking temporaries stay the size of a block
+def chunked_standardized_ranks(values, block, dtype=np.float64):
+    z = np.empty(values.shape, dtype=dtype)
+    for start in range(0, values.shape[1], block):
+        z[:, start:start + block] = standardized_ranks(values[:, start:start + block], dtype)
+    return z
+
+# Rows per block of the tiled engine, so that a block of the matrix with its absolute value and edge mask
+# (3 x b x p x 8 bytes) and the ranks it multiplies (n x b x 8 bytes) fit in the memory budget
+def tile_size(n_rows, n_columns, memory_budget=DEFAULT_TILE_BUDGET):
+    block = memory_budget // (24 * n_columns + 8 * n_rows)
+    return int(max(1, min(n_columns, block)))
+
+# Spearman correlation matrix computed with a single matrix multiply on the standardized ranks
+def spearman_blas(df, dtype=np.float64):
+    values = df.to_numpy(dtype=np.float64)
+    if np.isnan(values).any():
+        # Missing values need pairwise-complete ranks, which the rank-once engine cannot give
+        return spearman_pairwise(df, dtype)
+
+    z = standardized_ranks(values, dtype)
+    matrix_corr = z.T @ z
+    np.clip(matrix_corr, -1, 1, out=matrix_corr)
+    # Exact ones on the diagonal, except for constant columns which stay NaN
+    diagonal = np.diagonal(matrix_corr).copy()
+    diagonal[~np.isnan(diagonal)] = 1
+    np.fill_diagonal(matrix_corr, diagonal)
+    return pd.DataFrame(matrix_corr, index=df.columns, columns=df.columns)
+
+# Columns of values grouped by missing values pattern, and the pairs of patterns grouped by their common rows.
+# Returns the column indices of every pattern and a list of (rows, pattern_pairs), rows being the boolean
+# mask of the rows observed in both patterns of every (a, b) pair of pattern_pairs (a <= b).
+def missing_patterns(values):
+    patterns, pattern_of = np.unique(~np.isnan(values).T, axis=0, return_inverse=True)
+    pattern_of = pattern_of.ravel()
+    groups = [np.flatnonzero(pattern_of == index) for index in range(len(patterns))]
+    shared_rows = {}
+    for a in range(len(patterns)):
+        for b in range(a, len(patterns)):
+            rows = patterns[a] & patterns[b]
+            shared_rows.setdefault(rows.tobytes(), (rows, []))[1].append((a, b))
+    return groups, list(shared_rows.values())
+
+# Columns involved in the pattern pairs of a row set, in pattern order, and the slice of every pattern in them
+def pattern_columns(groups, pattern_pairs):
+    involved = sorted({index for pair in pattern_pairs for index in pair})
+    columns = np.concatenate([groups[index] for index in involved])
+    bounds = np.cumsum([0] + [len(groups[index]) for index in involved])
+    blocks = {index: slice(bounds[position], bounds[position + 1]) for position, index in enumerate(involved)}
+    return columns, blocks
+
+# Pairwise-complete Spearman matrix of df with missing values, same as pandas: each pair is ranked over
+# the rows where both columns are observed. The columns are grouped by missing values pattern, and every
+# pair of patterns with the same common rows is ranked once over these rows and computed with one
+# matrix multiply per pair of patterns, instead of one ranking per pair of columns.
+# When almost every column has its own pattern there is nothing to share, and the per-pair path of
+# pandas is faster (PAIRS_PER_RANKING).
+def spearman_pairwise(df, dtype=np.float64):
+    values = df.to_numpy(dtype=np.float64)
+    groups, shared_rows = missing_patterns(values)
+
+    n_columns = values.shape[1]
+    if len(shared_rows) * PAIRS_PER_RANKING > n_columns * (n_columns + 1) // 2:
+        return df.corr(method='spearman').astype(dtype, copy=False)
+    matrix_corr = np.full((n_columns, n_columns), np.nan, dtype=dtype)
+    for rows, pattern_pairs in shared_rows:
+        # Fewer than 2 common rows: no defined correlation, the pairs stay NaN
+        if rows.sum() < 2:
+            continue
+        columns, blocks = pattern_columns(groups, pattern_pairs)
+        z = standardized_ranks(values[np.ix_(rows, columns)], dtype)
+        for a, b in pattern_pairs:
+            tile = z[:, blocks[a]].T @ z[:, blocks[b]]
+            matrix_corr[np.ix_(groups[a], groups[b])] = tile
+            matrix_corr[np.ix_(groups[b], groups[a])] = tile.T
+    np.clip(matrix_corr, -1, 1, out=matrix_corr)
+    # Exact ones on the diagonal, except for columns constant (or almost empty) which stay NaN
+    diagonal = np.diagonal(matrix_corr).copy()
+    diagonal[~np.isnan(diagonal)] = 1
+    np.fill_diagonal(matrix_corr, diagonal)
+    return pd.DataFrame(matrix_corr, index=df.columns, columns=df.columns)
+
+# Number of rows where both columns are observed, for every pair of columns of df
+def pair_counts(df):
+    observed = df.notna().to_numpy(dtype=np.float64)
+    counts = np.rint(observed.T @ observed).astype(np.int64)
+    return pd.DataFrame(counts, index=df.columns, columns=df.columns)
+
+# Pair counts of df block of rows by block of rows, (start, rows) arrays like the tiles of spearman_tiled
+def pair_count_blocks(df, block):
+    observed = df.notna().to_numpy(dtype=np.float32)
+    for start in range(0, observed.shape[1], block):
+        yield start, observed[:, start:start + block].T @ observed
+
+
+# Rows start:stop of the pairwise-complete Spearman matrix of values (one tile of b x p), from the missing
+# values patterns of missing_patterns: the pairs of patterns with a column in the tile are ranked over their
+# common rows, the columns of a row set being ranked once for all its pairs, as in spearman_pairwise
+def pairwise_tile(values, groups, shared_rows, start, stop, dtype=np.float64):
+    tile = np.full((stop - start, values.shape[1]), np.nan, dtype=dtype)
+    in_tile = [group[(group >= start) & (group < stop)] for group in groups]
+    for rows, pattern_pairs in shared_rows:
+        pattern_pairs = [(a, b) for a, b in pattern_pairs if len(in_tile[a]) or len(in_tile[b])]
+        # Fewer than 2 common rows: no defined correlation, the pairs stay NaN
+        if rows.sum() < 2 or not pattern_pairs:
+            continue
+        columns, blocks = pattern_columns(groups, pattern_pairs)
+        z = standardized_ranks(values[np.ix_(rows, columns)], dtype)
+        for a, b in pattern_pairs:
+            for first, second in dict.fromkeys([(a, b), (b, a)]):
+                if len(in_tile[first]):
+                    local = blocks[first].start + np.searchsorted(groups[first], in_tile[first])
+                    tile[np.ix_(in_tile[first] - start, groups[second])] = z[:, local].T @ z[:, blocks[second]]
+    return tile
+
+# Rows start:stop of the pairwise-complete Spearman matrix of df, one pair of columns at a time (pandas),
+# for data where almost every column has its own missing values pattern
+def per_pair_tile(df, start, stop, dtype=np.float64):
+    tile = [df.corrwith(df.iloc[:, column], method='spearman').to_numpy(dtype=np.float64) for column in range(start, stop)]
+    return np.array(tile, dtype=dtype).reshape(stop - start, df.shape[1])
+
+# Out-of-core Spearman matrix of df, for data too wide for a p x p matrix in memory. The columns are ranked
+# in blocks, then the matrix is computed block of rows by block of rows (z[:, I].T @ z, one tile of b x p)
+# and each block is written through its own memory map into a float32 binary matrix at dest_path
+# (matrix_storage format). Peak memory is set by memory_budget (and the n x p ranks), not by p x p.
+# With missing values every tile is pairwise-complete, like spearman_pairwise: the ranks depend on the pair,
+# so the columns are ranked again for every tile over the common rows of each group of missing values patterns.
+# With edge_treshold, the pairs j < k with |r| >= edge_treshold are also returned as (rows, cols, weights)
+# arrays, None otherwise.
+def spearman_tiled(df, dest_path, memory_budget=DEFAULT_TILE_BUDGET, dtype=np.float64, edge_treshold=None):
+    values = df.to_numpy(dtype=np.float64)
+    n_rows, n_columns = values.shape
+    block = tile_size(n_rows, n_columns, memory_budget)
+    if np.isnan(values).any():
+        groups, shared_rows = missing_patterns(values)
+        if len(shared_rows) * PAIRS_PER_RANKING > n_columns * (n_columns + 1) // 2:
+            compute_tile = partial(per_pair_tile, df)
+        else:
+            compute_tile = partial(pairwise_tile, values, groups, shared_rows)
+    else:
+        z = chunked_standardized_ranks(values, block, dtype)
+        del values
+
+        def compute_tile(start, stop, dtype):
+            return z[:, start:stop].T @ z
+    edges = []
+
+    def row_blocks():
+        for start in range(0, n_columns, block):
+            stop = min(start + block, n_columns)
+            tile = compute_tile(start, stop, dtype)
+            np.clip(tile, -1, 1, out=tile)
+            # Exact ones on the diagonal, except for constant columns which stay NaN
+            diagonal = np.diagonal(tile, offset=start).copy()
+            diagonal[~np.isnan(diagonal)] = 1
+            tile[np.arange(stop - start), np.arange(start, stop)] = diagonal
+            # Stored as float32: the edges are selected on the coefficients the readers get back
+            tile = tile.astype(np.float32)
+            if edge_treshold is not None:
+                # Upper triangle only: columns after the row
+                with np.errstate(invalid='ignore'):
+                    selected = np.abs(tile) >= edge_treshold
+                selected &= np.arange(start, stop)[:, None] < np.arange(n_columns)[None, :]
+                rows, cols = np.nonzero(selected)
+                edges.append((rows + start, cols, tile[rows, cols]))
+            yield start, tile
+
+    ms.write_binary_rows(df.columns, dest_path, row_blocks())
+    if edge_treshold is None:
+        return None
+    if not edges:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    return tuple(np.concatenate(parts) for parts in zip(*edges))
+
+# Compute the Spearman correlation matrix of df with the selected engine
+def spearman_corr(df, engine="blas", dtype=np.float64):
+    if engine == "pandas":
+        return df.corr(method='spearman')
+    elif engine == "blas":
+        return spearman_blas(df, dtype)
+    else:
+        raise ValueError(f"Unknown correlation engine: {engine}")
+
+
+# Run a function and also return the elapsed time (s) and, with trace_memory, the peak traced memory (bytes),
+# None otherwise. tracemalloc slows the Python allocations down, so a traced time is not comparable
+# with an untraced one: peak memory is only measured on request.
+def timed(function, *args, trace_memory=False):
+    already_tracing = tracemalloc.is_tracing()
+    if trace_memory and not already_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    if trace_memory and not already_tracing:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+# Same as spearman_corr, but also returns the elapsed time (s) and the peak traced memory (bytes) with trace_memory
+def timed_spearman_corr(df, engine="blas", dtype=np.float64, trace_memory=False):
+    return timed(spearman_corr, df, engine, dtype, trace_memory=trace_memory)
+
+# Timing fields of the log lines: the time, and the peak memory when it was traced
+def timing_fields(elapsed, peak=None):
+    fields = f"time:{elapsed:.3f}s"
+    if peak is not None:
+        fields += f";peak_memory:{peak / 2**20:.1f}MB"
+    return fields
@@ -0,0 +1,376 @@
+import atexit
+import json
+import os
+import re
+import tempfile
+from my_globals import MAIN_PATH
+import network_manipulation as nm
+
+# Folder of every layer combination, and its layers: [1]=NT, [2]=SD, [3]=CD
+LAYER_FOLDERS = {
+    "TESTS": [1],
+    "DECO": [2],
+    "DAMAGE": [3],
+    "DECO_AND_TESTS": [1, 2],
+    "TESTS_AND_DAMAGE": [1, 3],
+    "DECO_AND_DAMAGE": [2, 3],
+    "DECO_TESTS_DAMAGE": [1, 2, 3]
+}
+
+# Layer combinations whose files do not depend on the imputation
+LAYERS_WITHOUT_IMP = ["DECO", "DAMAGE", "DECO_AND_DAMAGE"]
+
+# Fields of the key of a file, after its stage
+FIELDS = ["layers", "hemi", "imp", "test", "treshold", "analysis"]
+
+# Pattern of every field in a file name: hemispheres have no underscore, the other fields are
+# told apart by the fixed parts of the name around them
+FIELD_PATTERNS = {"hemi": "[^/_]+"}
+DEFAULT_FIELD_PATTERN = "[^/]+?"
+
+
+# One template per layer combination: with_imp, or without_imp for the layers that do not depend on the imputation
+def by_layers(with_imp, without_imp):
+    return {layers: without_imp if layers in LAYERS_WITHOUT_IMP else with_imp for layers in LAYER_FOLDERS}
+
+# Path of every file of the pipeline under the data root, by stage ("/" separated, {field} placeholders,
+# {label} is the label of the layers). A stage has one template, or one per layer combination.
+LAYOUT = {
+    # Preprocessing (steps 1 to 4)
+    "imputation_pre": "Données/TESTS/0_AFTER_IMPUTATIONS/pmm/{hemi}/{test}/Pre/IMPUTATION_{test}_{imp}.csv",
+    "imputation_post": "Données/TESTS/0_AFTER_IMPUTATIONS/pmm/{hemi}/{test}/Post_3M/IMPUTATION_{test}_{imp}.csv",
+    "grouping": "Données/TESTS/1_GROUPING_PRE_POST/PRE_POST_{hemi}/{test}/Pre_Post_{test}_{imp}.csv",
+    "deficit": "Données/TESTS/2_DEFICIT_PERCENTAGE_DATA/{hemi}_DEFICIT_PERCENTAGE_DATA/{test}/Deficit_Percentage_{test}_{imp}.csv",
+    "regression": "Données/TESTS/3_REG_MUL_DATA/{hemi}_REG_DATA/{test}/Reg_Lin_{test}_{imp}.csv",
+    "preprocessing_manifest": "Données/TESTS/build_manifest.json",
+    # Source files of the correlation networks
+    "network_source": {
+        "TESTS": "Données/TESTS/4_PRE_NETWORK_DATA/{hemi}_PRE_NET_DATA/Pre_Network_{imp}.csv",
+        "DECO": "Données/DECO/{hemi}_D_Data_Synth_filtered_80.csv",
+        "DAMAGE": "Données/DAMAGE/{hemi}_Percent_Damage_filtered_80.csv",
+        "DECO_AND_TESTS": "Données/DECO_AND_TESTS/{hemi}_DATA/{hemi}_data_{imp}_filtered_80.csv",
+        "TESTS_AND_DAMAGE": "Données/TESTS_AND_DAMAGE/{hemi}_DATA/{hemi}_data_{imp}_filtered_80.csv",
+        "DECO_AND_DAMAGE": "Données/DECO_AND_DAMAGE/{hemi}_DATA/{hemi}_data_filtered_80.csv",
+        "DECO_TESTS_DAMAGE": "Données/DECO_TESTS_DAMAGE/{hemi}_DATA/{hemi}_data_{imp}_filtered_80.csv"
+    },
+    # Correlation matrices, the "mean" imputation being the pooled matrix
+    "correlation": by_layers("Coding/Correlation_Matrix/{layers}/Spearman_Corr_Matrix_{hemi}_{imp}.csv",
+                             "Coding/Correlation_Matrix/{layers}/Spearman_Corr_Matrix_{hemi}.csv"),
+    "between_variance": "Coding/Correlation_Matrix/{layers}/Spearman_Between_Var_{hemi}.csv",
+    "correlation_manifest": "Coding/Correlation_Matrix/build_manifest.json",
+    # Plots and analyses
+    "multilayers_plot": "Coding/Correlation_Matrix/Multilayers_Plots/{treshold}/{hemi}/{label}/Correlationplot_{label}_{hemi}_{imp}.png",
+    "multilayers_legend": "Coding/Correlation_Matrix/Multilayers_Plots/{treshold}/{hemi}/{label}/Correlationlegend_{label}_{hemi}_{imp}.png",
+    "multilayers_manifest": "Coding/Correlation_Matrix/Multilayers_Plots/build_manifest.json",
+    "interactive_page": "Coding/Correlation_Matrix/Interactive_Plots/{treshold}/{hemi}/{label}/interactiveplot_{label}_{hemi}_{imp}.html",
+    "interactive_analysis": by_layers(
+        "Coding/Networks_Analyses/Analyses/{treshold}/{analysis}/{hemi}/{label}/interactiveplot_{label}_{analysis}_{hemi}_{imp}.html",
+        "Coding/Networks_Analyses/Analyses/{treshold}/{analysis}/{hemi}/{label}/interactiveplot_{label}_{analysis}_{hemi}.html"),
+    "interactive_manifest": "Coding/Correlation_Matrix/Interactive_Plots/build_manifest.json",
+    "interactive_dashboard": "Coding/Correlation_Matrix/Interactive_Dashboard/{label}",
+    "centrality_cache": "Coding/Networks_Analyses/Cache",
+    "layout_cache": "Coding/Networks_Analyses/Layouts",
+    "threshold_sweep": "Coding/Correlation_Matrix/Threshold_Sweeps/{label}/Sweep_{label}.csv",
+    "multilayer_metrics": "Coding/Networks_Analyses/Multilayer_Metrics/{label}/Multilayer_Metrics_{label}.csv"
+}
+
+# Environment variable through which worker processes find the catalog of the run
+CATALOG_PATH_VARIABLE = "DATA_CATALOG_PATH"
+
+# Catalog of this process
+_catalog = None
+
+
+# Folder of a layer combination, given as a list of layers ([1, 3]) or a name ("tests_and_damage")
+def layers_folder(layers):
+    if isinstance(layers, str):
+        if layers.upper() in LAYER_FOLDERS:
+            return layers.upper()
+    else:
+        for folder, folder_layers in LAYER_FOLDERS.items():
+            if list(layers) == folder_layers:
+                return folder
+    raise ValueError(f"Unknown layers: {layers}")
+
+# Imputations are numbers, except the pooled "mean"
+def imp_value(imp):
+    if isinstance(imp, str) and imp.isdigit():
+        return int(imp)
+    return imp
+
+# Template of a stage, for a layer combination when the stage has one per combination
+def stage_template(stage, layers=None):
+    if stage not in LAYOUT:
+        raise ValueError(f"Unknown stage: {stage}")
+    template = LAYOUT[stage]
+    if isinstance(template, dict):
+        template = template[layers]
+    if layers is not None:
+        template = template.replace("{layers}", layers).replace("{label}", nm.get_label(LAYER_FOLDERS[layers]))
+    return template
+
+# Every (stage, layers, template) of the layout, the layers and label placeholders filled
+def expanded_templates():
+    templates = []
+    for stage, template in LAYOUT.items():
+        if isinstance(template, dict) or "{layers}" in template or "{label}" in template:
+            for layers in LAYER_FOLDERS:
+                templates.append((stage, layers, stage_template(stage, layers)))
+        else:
+            templates.append((stage, None, template))
+    return templates
+
+# Regular expression matching the paths of a template, a field repeated in the path must be equal
+def template_pattern(template):
+    pattern = ""
+    seen = set()
+    for literal, field in re.findall(r"([^{]*)(?:\{(\w+)\})?", template):
+        pattern += re.escape(literal)
+        if field in seen:
+            pattern += f"(?P={field})"
+        elif field:
+            pattern += f"(?P<{field}>{FIELD_PATTERNS.get(field, DEFAULT_FIELD_PATTERN)})"
+            seen.add(field)
+    return re.compile(pattern + "$")
+
+# Directory to scan for the files of a template: its fixed leading directories.
+# None for a template without field, a single file is checked directly.
+def scan_directory(template):
+    if "{" not in template:
+        return None
+    parts = template.split("/")
+    fixed = []
+    for part in parts[:-1]:
+        if "{" in part:
+            break
+        fixed.append(part)
+    return "/".join(fixed)
+
+# Comparable form of a path: normalized, and case-insensitive on Windows
+def normalize(path):
+    return os.path.normcase(os.path.normpath(path))
+
+
+# Index of the pipeline files under a data root. The directories of the requested stages are walked once,
+# recording the size and modification time of every file, and the files are keyed by
+# (stage, layers, hemi, imp, test, treshold, analysis) when they match the layout. Existence and stat
+# lookups under the scanned directories are then answered from the index without touching the disk,
+# other paths fall back to os.stat. The index is saved as JSON, so worker processes reuse it.
+class DataCatalog:
+
+    def __init__(self, root=MAIN_PATH):
+        self.root = root
+        # (stage, layers, scanned directory, pattern) of every template with fields
+        self.patterns = [(stage, layers, scan_directory(template), template_pattern(template))
+                         for stage, layers, template in expanded_templates() if scan_directory(template) is not None]
+        self.scanned = []  # Normalized scanned directories
+        self.files = {}  # Normalized path -> {"path", "size", "mtime", "key"}
+        self.keys = {}  # Key -> normalized path
+
+    # Path of a file (or directory) of the layout. Fields the template does not use are ignored.
+    def path(self, stage, layers=None, hemi=None, imp=None, test=None, treshold=None, analysis=None):
+        folder = layers_folder(layers) if layers is not None else None
+        template = stage_template(stage, folder)
+        relative = template.format(hemi=hemi, imp=imp, test=test, treshold=treshold, analysis=analysis)
+        return os.path.join(self.root, *relative.split("/"))
+
+    # Key of a file of the layout, None for the fields its template does not use
+    def key(self, stage, layers=None, hemi=None, imp=None, test=None, treshold=None, analysis=None):
+        folder = layers_folder(layers) if layers is not None else None
+        template = stage_template(stage, folder)
+        values = {"layers": folder, "hemi": hemi, "imp": imp_value(imp), "test": test,
+                  "treshold": None if treshold is None else str(treshold), "analysis": analysis}
+        return (stage,) + tuple(values[field] if field == "layers" or "{" + field + "}" in template else None
+                                for field in FIELDS)
+
+    # Walk the directories of the stages once (every stage by default)
+    def scan(self, stages=None):
+        templates = [(stage, layers, template) for stage, layers, template in expanded_templates()
+                     if stages is None or stage in stages]
+        directories = sorted({scan_directory(template) for _, _, template in templates} - {None})
+        # A directory inside another one is covered by its walk
+        directories = [directory for directory in directories
+                       if not any(directory.startswith(other + "/") for other in directories)]
+
+        for directory in directories:
+            top = normalize(os.path.join(self.root, *directory.split("/")))
+            if top in self.scanned:
+                continue
+            self.scanned.append(top)
+            for path, stat in walk(top):
+                self.add(path, stat.st_size, stat.st_mtime_ns)
+
+    # Add a file to the index, keyed by the first template it matches
+    def add(self, path, size, mtime):
+        relative = os.path.relpath(path, self.root).replace(os.sep, "/")
+        key = None
+        for stage, layers, directory, pattern in self.patterns:
+            if not relative.startswith(directory + "/"):
+                continue
+            match = pattern.match(relative)
+            if match:
+                fields = match.groupdict()
+                key = (stage,) + tuple(layers if field == "layers" else
+                                       imp_value(fields.get(field)) if field == "imp" else fields.get(field) for field in FIELDS)
+                break
+        normalized = normalize(path)
+        self.files[normalized] = {"path": path, "size": size, "mtime": mtime, "key": key}
+        if key is not None:
+            self.keys[key] = normalized
+
+    # True when the path is under a scanned directory, so that the index is authoritative for it
+    def covers(self, normalized):
+        return any(normalized.startswith(directory + os.sep) for directory in self.scanned)
+
+    # (size, mtime in ns) of a file, None when it does not exist
+    def stat(self, path):
+        normalized = normalize(path)
+        if self.covers(normalized):
+            entry = self.files.get(normalized)
+            return (entry["size"], entry["mtime"]) if entry is not None else None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    # Update the index after a file was written (or removed) by this process
+    def record(self, path):
+        normalized = normalize(path)
+        if not self.covers(normalized):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            entry = self.files.pop(normalized, None)
+            if entry is not None and entry["key"] is not None:
+                self.keys.pop(entry["key"], None)
+            return
+        self.add(path, stat.st_size, stat.st_mtime_ns)
+
+    # Update the index for files written by other processes (the workers of a pool)
+    def refresh(self, paths):
+        for path in paths:
+            self.record(path)
+
+    # Indexed files of a stage matching the given fields: list of (key, path)
+    def find(self, stage, **fields):
+        found = []
+        for key, normalized in self.keys.items():
+            values = dict(zip(FIELDS, key[1:]))
+            if key[0] == stage and all(values[field] == value for field, value in fields.items()):
+                found.append((key, self.files[normalized]["path"]))
+        return sorted(found, key=lambda item: str(item[0]))
+
+    # Write the index as JSON, through a temporary file renamed into place
+    def save(self, catalog_path):
+        files = []
+        for entry in self.files.values():
+            record = {"path": entry["path"], "size": entry["size"], "mtime": entry["mtime"]}
+            if entry["key"] is not None:
+                record["stage"] = entry["key"][0]
+                record.update({field: value for field, value in zip(FIELDS, entry["key"][1:]) if value is not None})
+            files.append(record)
+        os.makedirs(os.path.dirname(os.path.abspath(catalog_path)), exist_ok=True)
+        tmp_path = f"{catalog_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"root": self.root, "scanned": self.scanned, "files": files}, f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, catalog_path)
+
+    # Read an index written by save
+    @classmethod
+    def load(cls, catalog_path):
+        with open(catalog_path, encoding='utf-8') as f:
+            content = json.load(f)
+        catalog = cls(content["root"])
+        catalog.scanned = content["scanned"]
+        for record in content["files"]:
+            key = None
+            if "stage" in record:
+                key = (record["stage"],) + tuple(record.get(field) for field in FIELDS)
+            normalized = normalize(record["path"])
+            catalog.files[normalized] = {"path": record["path"], "size": record["size"], "mtime": record["mtime"], "key": key}
+            if key is not None:
+                catalog.keys[key] = normalized
+        return catalog
+
+
+# Every file under a directory with its stat, in a single walk (the stat comes with the directory
+# listing on Windows). Nothing when the directory does not exist.
+def walk(directory):
+    pending = [directory]
+    while pending:
+        current_dir = pending.pop()
+        try:
+            entries = list(os.scandir(current_dir))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            if entry.is_dir():
+                pending.append(entry.path)
+            elif entry.is_file():
+                yield entry.path, entry.stat()
+
+
+# Catalog of this process: the one started by the script, the one of the parent run in a worker
+# process, or an empty one checking every path on disk
+def current():
+    global _catalog
+    if _catalog is None:
+        catalog_path = os.environ.get(CATALOG_PATH_VARIABLE)
+        if catalog_path and os.path.exists(catalog_path):
+            _catalog = DataCatalog.load(catalog_path)
+        else:
+            _catalog = DataCatalog()
+    return _catalog
+
+# Remove a file if it still exists
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Scan the directories of the stages used by a script, save the index and announce it to the worker processes.
+# Without catalog_path, the index is written to a file of this run in the temporary directory, removed when
+# the script exits: scripts running at the same time never overwrite each other's index.
+def start(stages=None, root=MAIN_PATH, catalog_path=None):
+    global _catalog
+    _catalog = DataCatalog(root)
+    _catalog.scan(stages)
+    if catalog_path is None:
+        descriptor, catalog_path = tempfile.mkstemp(prefix="data_catalog_", suffix=".json")
+        os.close(descriptor)
+        atexit.register(remove_file, catalog_path)
+    _catalog.save(catalog_path)
+    os.environ[CATALOG_PATH_VARIABLE] = catalog_path
+    return _catalog
+
+def path(stage, layers=None, hemi=None, imp=None, test=None, treshold=None, analysis=None):
+    return current().path(stage, layers, hemi, imp, test, treshold, analysis)
+
+def exists(path):
+    return current().exists(path)
+
+def stat(path):
+    return current().stat(path)
+
+def record(path):
+    current().record(path)
+
+def refresh(paths):
+    current().refresh(paths)
+
+# Command line options shared by the scripts
+def add_arguments(parser):
+    parser.add_argument("--data-root", default=MAIN_PATH, help="Root of the Données and Coding trees")
+    parser.add_argument("--catalog", default=None,
+                        help="Index of the data files written by the scan, for inspection "
+                             "(default: a file of this run in the temporary directory, removed at exit)")
+
+# Start the catalog of a script from its parsed command line options
+def start_from_args(args, stages=None):
+    return start(stages, args.data_root, args.catalog)
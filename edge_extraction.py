@@ -0,0 +1,123 @@
+import numpy as np
+import matrix_storage as ms
+
+
+# Edge intervals for a threshold: [-1, -treshold] and [treshold, 1], or only the positive one
+def threshold_intervals(treshold, negative=True):
+    intervals = [(treshold, 1)]
+    if negative:
+        intervals.insert(0, (-1, -treshold))
+    return intervals
+
+# Name of a threshold in the output paths: the correlation threshold, followed by the FDR level when
+# the edges must also be significant
+def treshold_key(treshold, alpha=None):
+    if alpha is None:
+        return str(treshold)
+    return f"{treshold}_q{alpha}"
+
+# Upper-triangle entries (j < k) of a correlation matrix that fall in any of the [min, max] intervals,
+# and whose q-value is at most alpha when a q-value matrix is given.
+# Returns the row indices, the column indices and the weights as arrays.
+def extract_edges(matrix, intervals, qvalues=None, alpha=None):
+    values = np.asarray(matrix)
+    in_interval = np.zeros(values.shape, dtype=bool)
+    for min_tresh, max_tresh in intervals:
+        in_interval |= (min_tresh <= values) & (values <= max_tresh)
+    if qvalues is not None:
+        in_interval &= np.asarray(qvalues) <= alpha
+    # Keep each pair once and drop the diagonal
+    positions = np.arange(values.shape[0])
+    in_interval &= positions[:, None] < positions[None, :]
+    rows, cols = np.nonzero(in_interval)
+    return rows, cols, values[rows, cols]
+
+# Edges as (node1, node2, attributes) tuples, ready for G.add_edges_from
+def edge_tuples(names, rows, cols, weights, weight_scale=1):
+    names = list(names)
+    # Plain Python floats, numpy scalars are not JSON serializable for pyvis
+    weights = (np.asarray(weights, dtype=np.float64) * weight_scale).tolist()
+    return [(names[j], names[k], {"weight": weight}) for j, k, weight in zip(rows.tolist(), cols.tolist(), weights)]
+
+# Values of a q-value DataFrame in the order of the given variables
+def aligned_qvalues(qvalues, names):
+    # Rows follow the columns order (a matrix read from CSV has no row labels)
+    positions = qvalues.columns.get_indexer(names)
+    if (positions < 0).any():
+        raise ValueError("The q-value matrix does not cover every variable of the correlation matrix")
+    return qvalues.to_numpy()[np.ix_(positions, positions)]
+
+# Add the edges of a correlation matrix DataFrame to one or more graphs in a single bulk call each.
+# With a q-value DataFrame (same variables), only the pairs with q <= alpha are kept.
+def add_matrix_edges(graphs, df, intervals, weight_scale=1, qvalues=None, alpha=None):
+    if qvalues is not None:
+        qvalues = aligned_qvalues(qvalues, df.columns)
+    rows, cols, weights = extract_edges(df.to_numpy(), intervals, qvalues, alpha)
+    edges = edge_tuples(df.columns, rows, cols, weights, weight_scale)
+    for G in graphs:
+        G.add_edges_from(edges)
+    return len(edges)
+
+# True when an edge list holding every pair with |r| >= min_treshold has all the pairs of the intervals
+def edges_cover(min_treshold, intervals):
+    return min_treshold is not None and all(low >= min_treshold or high <= -min_treshold for low, high in intervals)
+
+# Entries of a sparse edge list that fall in any of the [min, max] intervals, and whose q-value
+# (matrix in the order of the edge list names) is at most alpha: same result as extract_edges on the matrix
+# read back by load_matrix, the edge list holding the same rounded (CSV) or float32 (binary) coefficients
+def select_edges(edges, intervals, qvalues=None, alpha=None):
+    weights = edges["weights"]
+    selected = np.zeros(len(weights), dtype=bool)
+    for min_tresh, max_tresh in intervals:
+        selected |= (min_tresh <= weights) & (weights <= max_tresh)
+    rows, cols = edges["rows"][selected], edges["cols"][selected]
+    if qvalues is not None:
+        significant = np.asarray(qvalues)[rows, cols] <= alpha
+        rows, cols, weights = rows[significant], cols[significant], weights[selected][significant]
+        return rows, cols, weights
+    return rows, cols, weights[selected]
+
+# Add the edges of a sparse edge list to one or more graphs, like add_matrix_edges
+def add_edge_list_edges(graphs, edges, intervals, weight_scale=1, qvalues=None, alpha=None):
+    if qvalues is not None:
+        qvalues = aligned_qvalues(qvalues, edges["names"])
+    rows, cols, weights = select_edges(edges, intervals, qvalues, alpha)
+    edge_list = edge_tuples(edges["names"], rows, cols, weights, weight_scale)
+    for G in graphs:
+        G.add_edges_from(edge_list)
+    return len(edge_list)
+
+# A graph is built from the sparse edge list of a matrix when it has every edge of the intervals,
+# from the dense matrix otherwise. Both are called a graph source.
+def uses_edge_list(csv_path, intervals):
+    return edges_cover(ms.edges_min_treshold(csv_path), intervals)
+
+# Files a graph with these intervals is read from
+def source_files(csv_path, intervals):
+    if uses_edge_list(csv_path, intervals):
+        return [ms.edges_path(csv_path)]
+    return ms.matrix_files(csv_path)
+
+# Read the graph source of a matrix: its edge list (dict) when it covers the intervals, the matrix DataFrame otherwise
+def load_source(csv_path, intervals):
+    if uses_edge_list(csv_path, intervals):
+        return ms.load_edges(csv_path)
+    return ms.load_matrix(csv_path)
+
+# Node names of a graph source
+def source_names(source):
+    if isinstance(source, dict):
+        return source["names"]
+    return list(source.columns)
+
+# Upper-triangle (rows, cols, weights) edges of a graph source inside any of the intervals
+def source_edges(source, intervals):
+    if isinstance(source, dict):
+        return select_edges(source, intervals)
+    return extract_edges(source.to_numpy(), intervals)
+
+# Add the edges of a graph source to one or more graphs
+def add_source_edges(graphs, source, intervals, weight_scale=1, qvalues=None, alpha=None):
+    if isinstance(source, dict):
+        return add_edge_list_edges(graphs, source, intervals, weight_scale, qvalues, alpha)
+    return add_matrix_edges(graphs, source, intervals, weight_scale, qvalues, alpha)
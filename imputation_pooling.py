@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+# Correlations are clipped to +/-(1 - Z_CLIP) before the Fisher transform, so that off-diagonal
+# coefficients of exactly +/-1 give a large but finite z
+Z_CLIP = 1e-12
+
+
+# Pool the correlation matrices of the imputations of one dataset with Rubin's rules in Fisher-z space.
+# The matrices are added one at a time (Welford running mean and sum of squared deviations), so only
+# O(p²) memory is used whatever the number of imputations:
+#   pooled z = mean of z over the m imputations, pooled correlation = tanh(pooled z)
+#   between-imputation variance B = sum((z - pooled z)²) / (m - 1)
+class FisherZPool:
+
+    def __init__(self):
+        self.count = 0
+        self.columns = None
+        self.mean = None
+        self.squares = None
+
+    # Add the correlation matrix of one imputation
+    def add(self, matrix_corr):
+        if self.columns is None:
+            self.columns = matrix_corr.columns
+            self.mean = np.zeros(matrix_corr.shape, dtype=np.float64)
+            self.squares = np.zeros(matrix_corr.shape, dtype=np.float64)
+        elif not self.columns.equals(matrix_corr.columns):
+            raise ValueError("Imputation matrices to pool have different variables")
+
+        z = np.arctanh(np.clip(matrix_corr.to_numpy(dtype=np.float64), -1 + Z_CLIP, 1 - Z_CLIP))
+        self.count += 1
+        delta = z - self.mean
+        self.mean += delta / self.count
+        self.squares += delta * (z - self.mean)
+
+    # Pooled correlation matrix, with exact ones on the diagonal
+    def pooled_matrix(self):
+        matrix_corr = np.tanh(self.mean)
+        diagonal = np.diagonal(matrix_corr).copy()
+        diagonal[~np.isnan(diagonal)] = 1
+        np.fill_diagonal(matrix_corr, diagonal)
+        return pd.DataFrame(matrix_corr, index=self.columns, columns=self.columns)
+
+    # Between-imputation variance of the Fisher z coefficients, zero on the diagonal
+    def between_variance(self):
+        if self.count < 2:
+            raise ValueError("The between-imputation variance needs at least two imputations")
+        variance = self.squares / (self.count - 1)
+        diagonal = np.diagonal(variance).copy()
+        diagonal[~np.isnan(diagonal)] = 0
+        np.fill_diagonal(variance, diagonal)
+        return pd.DataFrame(variance, index=self.columns, columns=self.columns)
@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import pyvis
+from pyvis.network import Network
+
+# vis-network bundle shipped with pyvis, copied once per output tree
+VIS_DIR = os.path.join(os.path.dirname(pyvis.__file__), "lib", "vis-9.1.2")
+ASSETS = ["vis-network.min.js", "vis-network.css"]
+
+# Single page that lists the exported graphs and loads the selected one on demand.
+# Payloads are small scripts calling registerGraph(), so the page also works from file:// URLs.
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<link rel="stylesheet" href="assets/vis-network.css">
+<script src="assets/vis-network.min.js"></script>
+<script src="catalog.js"></script>
+<style>
+body { margin: 0; font-family: Tahoma; }
+#controls { padding: 8px; border-bottom: 1px solid #ccc; }
+#graph { position: absolute; top: 45px; bottom: 0; left: 0; right: 0; }
+#legend { position: absolute; top: 55px; right: 10px; background: white; padding: 10px; border: 1px solid #ccc; font-size: 14px; z-index: 999; }
+</style>
+</head>
+<body>
+<div id="controls">
+Threshold <select id="treshold"></select>
+Hemisphere <select id="hemi"></select>
+Imputation <select id="imp"></select>
+Metric <select id="metric"></select>
+<span id="status"></span>
+</div>
+<div id="graph"></div>
+<div id="legend">
+<strong>Légende</strong><br>
+<span style="color:#00008d;">■</span> NT<br>
+<span style="color:#006300;">■</span> SD<br>
+<span style="color:#fb0000;">■</span> CD<br>
+</div>
+<script>
+var payloads = {};
+var network = null;
+
+function fillSelect(id, values) {
+    var select = document.getElementById(id);
+    values.forEach(function (value) {
+        var option = document.createElement("option");
+        option.value = option.text = value;
+        select.appendChild(option);
+    });
+    select.onchange = show;
+}
+
+function unique(field) {
+    return CATALOG.map(function (entry) { return entry[field]; })
+        .filter(function (value, index, values) { return values.indexOf(value) === index; });
+}
+
+function selection() {
+    var selected = {};
+    ["treshold", "hemi", "imp", "metric"].forEach(function (id) { selected[id] = document.getElementById(id).value; });
+    return selected;
+}
+
+function registerGraph(key, payload) {
+    payloads[key] = payload;
+    show();
+}
+
+function show() {
+    var selected = selection();
+    var entry = CATALOG.find(function (entry) {
+        return entry.treshold === selected.treshold && entry.hemi === selected.hemi && entry.imp === selected.imp;
+    });
+    var status = document.getElementById("status");
+    if (!entry) {
+        status.textContent = "No graph for this selection.";
+        return;
+    }
+    if (!(entry.key in payloads)) {
+        // Load the payload of this graph only when it is first selected
+        status.textContent = "Loading...";
+        var script = document.createElement("script");
+        script.src = entry.file;
+        document.body.appendChild(script);
+        return;
+    }
+    status.textContent = "";
+    draw(payloads[entry.key], selected.metric);
+}
+
+function draw(payload, metric) {
+    var sizes = payload.sizes[metric];
+    var nodes = payload.nodes.map(function (node) {
+        var copy = Object.assign({}, node);
+        if (sizes) { copy.size = sizes[node.id]; }
+        return copy;
+    });
+    var options = sizes ? payload.options.analyses : payload.options.network;
+    var data = {nodes: new vis.DataSet(nodes), edges: new vis.DataSet(payload.edges)};
+    if (network !== null) { network.destroy(); }
+    network = new vis.Network(document.getElementById("graph"), data, options);
+}
+
+fillSelect("treshold", unique("treshold"));
+fillSelect("hemi", unique("hemi"));
+fillSelect("imp", unique("imp"));
+fillSelect("metric", ["network"].concat(METRICS));
+show();
+</script>
+</body>
+</html>
+"""
+
+
+# Parse a pyvis options string ("{...}" or "var options = {...}") the way Network.set_options does
+def parse_options(options):
+    options = options.replace("\n", "").replace(" ", "")
+    return json.loads(options[options.find("{"):])
+
+# Copy the vis-network assets into the output tree, once
+def write_assets(output_root):
+    assets_dir = os.path.join(output_root, "assets")
+    os.makedirs(assets_dir, exist_ok=True)
+    for asset in ASSETS:
+        dest_path = os.path.join(assets_dir, asset)
+        if not os.path.exists(dest_path):
+            shutil.copyfile(os.path.join(VIS_DIR, asset), dest_path)
+
+# Relative path of the payload of a graph inside the output tree
+def payload_path(treshold, hemi, imp):
+    return os.path.join("data", str(treshold), str(hemi), f"graph_{imp}.js")
+
+# Write the payload of a graph: its nodes and edges converted by pyvis, the node sizes of every metric
+# and both option sets. The metric views reuse the same nodes and edges.
+def write_payload(output_root, G, sizes, treshold, hemi, imp, options, options_analyses):
+    net = Network(notebook=True, cdn_resources='in_line')
+    net.from_nx(G, show_edge_weights=True)
+    payload = {
+        "nodes": net.nodes,
+        "edges": net.edges,
+        "sizes": sizes,
+        "options": {"network": parse_options(options), "analyses": parse_options(options_analyses)}
+    }
+    key = f"{treshold}/{hemi}/{imp}"
+    dest_path = os.path.join(output_root, payload_path(treshold, hemi, imp))
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    with open(dest_path, 'w', encoding='utf-8') as f:
+        f.write(f"registerGraph({json.dumps(key)}, {json.dumps(payload, default=float)});\n")
+    return dest_path
+
+# Write the dashboard page and the catalog of every payload present in the output tree
+def write_dashboard(output_root, title, metrics):
+    catalog = []
+    data_dir = os.path.join(output_root, "data")
+    for dirpath, _, filenames in os.walk(data_dir):
+        for filename in sorted(filenames):
+            if not (filename.startswith("graph_") and filename.endswith(".js")):
+                continue
+            treshold, hemi = os.path.relpath(dirpath, data_dir).split(os.sep)
+            imp = filename[len("graph_"):-len(".js")]
+            catalog.append({
+                "key": f"{treshold}/{hemi}/{imp}",
+                "treshold": treshold,
+                "hemi": hemi,
+                "imp": imp,
+                "file": "/".join(["data", treshold, hemi, filename])
+            })
+    catalog.sort(key=lambda entry: (entry["treshold"], entry["hemi"], entry["imp"]))
+
+    with open(os.path.join(output_root, "catalog.js"), 'w', encoding='utf-8') as f:
+        f.write(f"var CATALOG = {json.dumps(catalog, indent=1)};\nvar METRICS = {json.dumps(list(metrics))};\n")
+    with open(os.path.join(output_root, "index.html"), 'w', encoding='utf-8') as f:
+        f.write(DASHBOARD_HTML.replace("__TITLE__", title))
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+import network_manipulation as nm
+import data_catalog as dc
+
+# Formats in which a correlation matrix can be written
+MATRIX_FORMATS = ["csv", "bin", "both"]
+
+# Extension of the raw float32 array and of its sidecar (node names, layer tags, shape)
+BINARY_EXTENSION = ".f32"
+SIDECAR_EXTENSION = ".json"
+
+
+# Paths of the binary matrix and of its sidecar, next to the CSV path of the same matrix
+def binary_paths(csv_path):
+    root, _ = os.path.splitext(csv_path)
+    return root + BINARY_EXTENSION, root + SIDECAR_EXTENSION
+
+# Write a file through a temporary file renamed into place, so readers never see a partial file.
+# The directory of the file is created when missing (first build of a data tree).
+def atomic_write(dest_path, write):
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, dest_path)
+    dc.record(dest_path)
+
+# Remove a file left by an earlier build in another format, so that readers never pick it up
+def remove_stale(path):
+    if os.path.exists(path):
+        os.remove(path)
+    dc.record(path)
+
+# Write a small JSON document
+def write_json(content, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(content, f)
+
+# Write a correlation matrix as a semicolon CSV with a "Name" column, rounded to 3 decimals by default
+def write_csv(matrix_corr, dest_path, decimals=3):
+    df_corr = pd.DataFrame(matrix_corr)
+    df_corr.insert(0, 'Name', df_corr.index)
+    df_corr = df_corr.round(decimals)
+    atomic_write(dest_path, lambda path: df_corr.to_csv(path, sep=';', index=False))
+
+# Sidecar of a binary matrix: node names, their layers, shape and dtype
+def binary_sidecar(names, shape):
+    names = [str(name) for name in names]
+    return {
+        "names": names,
+        "layers": [nm.get_layer(name) for name in names],
+        "shape": list(shape),
+        "dtype": "float32"
+    }
+
+# Write a correlation matrix as a raw float32 array plus a JSON sidecar with the node names
+# and their layers. The CSV path of the matrix is given, the extensions are replaced.
+def write_binary(matrix_corr, dest_path):
+    data_path, meta_path = binary_paths(dest_path)
+    values = np.ascontiguousarray(matrix_corr.to_numpy(dtype=np.float32))
+    meta = binary_sidecar(matrix_corr.columns, values.shape)
+    atomic_write(data_path, values.tofile)
+    # The sidecar is written last: a matrix is only visible once both files are complete
+    atomic_write(meta_path, lambda path: write_json(meta, path))
+
+# Write a binary matrix too large for memory from its blocks of rows: row_blocks yields (start, rows)
+# arrays, each one written through a memory map of its own rows, so that a single block is mapped at a time
+def write_binary_rows(names, dest_path, row_blocks):
+    data_path, meta_path = binary_paths(dest_path)
+    shape = (len(names), len(names))
+
+    def write(path):
+        # Sized once, the blocks are then written in place
+        np.memmap(path, dtype=np.float32, mode='w+', shape=shape).flush()
+        for start, rows in row_blocks:
+            window = np.memmap(path, dtype=np.float32, mode='r+', offset=start * shape[1] * 4, shape=rows.shape)
+            window[:] = rows
+            window.flush()
+            del window
+
+    atomic_write(data_path, write)
+    atomic_write(meta_path, lambda path: write_json(binary_sidecar(names, shape), path))
+    # Only the binary matrix is written: a CSV of an earlier build would be stale
+    remove_stale(dest_path)
+
+# Path of the matrix of per-pair observation counts stored next to a correlation matrix
+def pair_counts_path(csv_path):
+    directory, filename = os.path.split(csv_path)
+    return os.path.join(directory, filename.replace("Spearman_Corr_Matrix", "Spearman_Pair_Counts"))
+
+# Path of the sparse edge list stored next to a correlation matrix
+def edges_path(csv_path):
+    directory, filename = os.path.split(csv_path)
+    root, _ = os.path.splitext(filename.replace("Spearman_Corr_Matrix", "Spearman_Edges"))
+    return os.path.join(directory, root + ".npz")
+
+# Write the edges of a correlation matrix as a sparse COO edge list: one column of row indices, one of
+# column indices and one of coefficients, with the node names and the minimum |r| kept. The coefficients
+# are kept as given, which should be the stored_values of the matrix.
+def write_edges(names, rows, cols, weights, min_treshold, dest_path):
+    content = {
+        "rows": np.asarray(rows, dtype=np.int32),
+        "cols": np.asarray(cols, dtype=np.int32),
+        "weights": np.asarray(weights),
+        "names": np.array([str(name) for name in names]),
+        "min_treshold": np.float64(min_treshold)
+    }
+
+    def write(path):
+        with open(path, 'wb') as f:
+            np.savez(f, **content)
+
+    atomic_write(edges_path(dest_path), write)
+
+# Minimum |r| of the edge list stored next to a matrix, None when there is none.
+# Only this entry of the archive is read.
+def edges_min_treshold(csv_path):
+    path = edges_path(csv_path)
+    if not dc.exists(path):
+        return None
+    with np.load(path) as content:
+        return float(content["min_treshold"])
+
+# Read the edge list stored next to a matrix: {"names", "rows", "cols", "weights", "min_treshold"}
+def load_edges(csv_path):
+    with np.load(edges_path(csv_path)) as content:
+        return {
+            "names": content["names"].tolist(),
+            "rows": content["rows"].astype(np.int64),
+            "cols": content["cols"].astype(np.int64),
+            "weights": content["weights"],
+            "min_treshold": float(content["min_treshold"])
+        }
+
+# Values of a matrix as load_matrix reads them back once written in the format: rounded to decimals from the
+# CSV, float32 from the binary matrix (read first when both are written). Edges extracted from these values
+# are the edges the readers would extract from the matrix itself.
+def stored_values(matrix_corr, fmt="csv", decimals=3):
+    values = np.asarray(matrix_corr, dtype=np.float64)
+    if fmt == "csv":
+        return np.round(values, decimals)
+    return values.astype(np.float32)
+
+# Write a correlation matrix in the requested format(s). The files of the other format, from an earlier
+# build, are removed: the readers prefer the binary matrix and would otherwise load a stale one.
+def write_matrix(matrix_corr, dest_path, fmt="csv", decimals=3):
+    if fmt in ["csv", "both"]:
+        write_csv(matrix_corr, dest_path, decimals)
+    else:
+        remove_stale(dest_path)
+    if fmt in ["bin", "both"]:
+        write_binary(matrix_corr, dest_path)
+    else:
+        # Sidecar first: a binary matrix is only visible while its sidecar exists
+        for path in reversed(binary_paths(dest_path)):
+            remove_stale(path)
+
+# Remove a matrix in every format, the sidecar before its binary array
+def remove_matrix(csv_path):
+    remove_stale(csv_path)
+    for path in reversed(binary_paths(csv_path)):
+        remove_stale(path)
+
+# Files written for a matrix in the requested format(s)
+def output_files(csv_path, fmt="csv"):
+    files = []
+    if fmt in ["csv", "both"]:
+        files.append(csv_path)
+    if fmt in ["bin", "both"]:
+        files.extend(binary_paths(csv_path))
+    return files
+
+# Files load_matrix reads for a matrix: the binary pair when available, the CSV otherwise
+def matrix_files(csv_path):
+    data_path, meta_path = binary_paths(csv_path)
+    if dc.exists(meta_path):
+        return [data_path, meta_path]
+    return [csv_path]
+
+# True when the matrix exists in either format
+def matrix_exists(csv_path):
+    _, meta_path = binary_paths(csv_path)
+    return dc.exists(meta_path) or dc.exists(csv_path)
+
+# Read the sidecar of a binary matrix
+def read_sidecar(csv_path):
+    _, meta_path = binary_paths(csv_path)
+    with open(meta_path, encoding='utf-8') as f:
+        return json.load(f)
+
+# Open a binary matrix as a DataFrame backed by a read-only memory map
+def read_binary(csv_path):
+    data_path, _ = binary_paths(csv_path)
+    meta = read_sidecar(csv_path)
+    values = np.memmap(data_path, dtype=meta["dtype"], mode='r', shape=tuple(meta["shape"]))
+    return pd.DataFrame(values, index=meta["names"], columns=meta["names"], copy=False)
+
+# Read a correlation matrix without its "Name" column, from the binary format when available
+def load_matrix(csv_path):
+    _, meta_path = binary_paths(csv_path)
+    if dc.exists(meta_path):
+        return read_binary(csv_path)
+    df = pd.read_csv(csv_path, delimiter=';')
+    return df.drop("Name", axis=1)
+
+# Convert an existing CSV matrix to the binary format
+def convert_csv(csv_path):
+    df = pd.read_csv(csv_path, delimiter=';')
+    matrix_corr = df.drop("Name", axis=1)
+    matrix_corr.index = df["Name"]
+    write_binary(matrix_corr, csv_path)
+
+# Convert every Spearman CSV matrix found under a directory
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the CSV correlation matrices to the binary format.")
+    parser.add_argument("root", help="Directory scanned recursively for Spearman_*.csv matrices")
+    parser.add_argument("--overwrite", action="store_true", help="Convert matrices that already have a binary copy")
+    args = parser.parse_args()
+
+    for dirpath, _, filenames in os.walk(args.root):
+        for filename in sorted(filenames):
+            if not (filename.startswith("Spearman_") and filename.endswith(".csv")):
+                continue
+            csv_path = os.path.join(dirpath, filename)
+            if not args.overwrite and os.path.exists(binary_paths(csv_path)[1]):
+                continue
+            print(f"Converting {csv_path}")
+            convert_csv(csv_path)
@@ -0,0 +1,148 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import network_manipulation as nm
+import matrix_storage as ms
+import edge_extraction as ee
+import data_catalog as dc
+
+# Metrics of every node: degree and strength (sum of |r|) toward its own layer and toward the other
+# layers, and participation coefficient (1 - sum over layers of the squared share of its degree)
+NODE_METRICS = ["degree_intra", "degree_inter", "strength_intra", "strength_inter", "participation"]
+
+# Metrics of every pair of layers: edges between the two layers and their share of the possible pairs
+LAYER_PAIR_METRICS = ["edges", "density"]
+
+
+# Layer of every node ([1]=NT, [2]=SD, [3]=CD), the layers present and the index of the layer of every node
+def node_layers(names):
+    layers = np.array([nm.get_layer(name) for name in names])
+    present = np.unique(layers)
+    return layers, present, np.searchsorted(present, layers)
+
+# Degrees and strengths of every node toward every layer, at every threshold: two (tresholds x nodes x layers)
+# arrays. The edges at a threshold are those of every higher threshold plus the new ones, so each edge is
+# added once to the block of the highest threshold it passes and the blocks are summed down the thresholds.
+# tresholds must be in decreasing order, keys are the values compared with them (|r| or r).
+def layer_degrees(rows, cols, weights, keys, layer_index, n_layers, tresholds):
+    n_nodes = len(layer_index)
+    shape = (len(tresholds), n_nodes, n_layers)
+    # Index of the highest threshold passed by each edge, len(tresholds) when none is
+    first = np.searchsorted(-np.asarray(tresholds, dtype=np.float64), -keys, side='left')
+    passed = first < len(tresholds)
+    first, rows, cols, weights = first[passed], rows[passed], cols[passed], np.abs(weights[passed])
+
+    # Every edge counts for both of its ends, toward the layer of the other end
+    ends = np.concatenate([rows, cols])
+    other_layers = np.concatenate([layer_index[cols], layer_index[rows]])
+    flat = np.ravel_multi_index((np.tile(first, 2), ends, other_layers), shape)
+    size = len(tresholds) * n_nodes * n_layers
+    degrees = np.bincount(flat, minlength=size).reshape(shape).cumsum(axis=0)
+    strengths = np.bincount(flat, weights=np.tile(weights, 2), minlength=size).reshape(shape).cumsum(axis=0)
+    return degrees, strengths
+
+# Node metrics (one row per threshold and node) from the degrees and strengths toward every layer
+def node_metrics(names, layers, layer_index, degrees, strengths, tresholds):
+    own = np.arange(len(names)), layer_index
+    degree = degrees.sum(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = degrees / degree[:, :, None]
+    # Isolated nodes have a participation of 0
+    participation = np.where(degree > 0, 1 - np.nansum(shares ** 2, axis=2), 0)
+    metrics = {
+        "degree_intra": degrees[:, own[0], own[1]],
+        "degree_inter": degree - degrees[:, own[0], own[1]],
+        "strength_intra": strengths[:, own[0], own[1]],
+        "strength_inter": strengths.sum(axis=2) - strengths[:, own[0], own[1]],
+        "participation": participation
+    }
+    table = pd.DataFrame({metric: values.ravel() for metric, values in metrics.items()})
+    table.insert(0, "layer", np.tile(layers, len(tresholds)))
+    table.insert(0, "name", np.tile(np.asarray(names, dtype=object), len(tresholds)))
+    table.insert(0, "treshold", np.repeat(tresholds, len(names)))
+    return table
+
+# Layer-pair metrics (one row per threshold and pair of layers) from the degrees toward every layer:
+# the edges between layers s and t are the degrees of the nodes of s toward t (counted twice when s = t)
+def layer_pair_metrics(present, layer_index, degrees, tresholds):
+    sizes = np.bincount(layer_index, minlength=len(present))
+    membership = np.eye(len(present))[layer_index]
+    block_edges = np.einsum('ns,tnl->tsl', membership, degrees)
+    pairs = []
+    for s in range(len(present)):
+        for t in range(s, len(present)):
+            if s == t:
+                edges = block_edges[:, s, s] / 2
+                possible = sizes[s] * (sizes[s] - 1) / 2
+            else:
+                edges = block_edges[:, s, t]
+                possible = sizes[s] * sizes[t]
+            pairs.append(pd.DataFrame({
+                "treshold": tresholds,
+                "name": f"{nm.get_label([present[s]])}-{nm.get_label([present[t]])}",
+                "edges": edges,
+                "density": edges / possible if possible else 0.0
+            }))
+    return pd.concat(pairs, ignore_index=True)
+
+# Tidy table of every metric of a graph source (correlation matrix or edge list) at every threshold:
+# one row per (treshold, scope, name, metric) with scope "node" or "layer_pair"
+def multilayer_table(source, tresholds, negative=True):
+    tresholds = sorted(tresholds, reverse=True)
+    names = ee.source_names(source)
+    layers, present, layer_index = node_layers(names)
+    rows, cols, weights = ee.source_edges(source, ee.threshold_intervals(min(tresholds), negative))
+    keys = np.abs(weights) if negative else weights
+    degrees, strengths = layer_degrees(rows, cols, weights, keys, layer_index, len(present), tresholds)
+
+    nodes = node_metrics(names, layers, layer_index, degrees, strengths, tresholds)
+    nodes = nodes.melt(id_vars=["treshold", "name", "layer"], value_vars=NODE_METRICS, var_name="metric")
+    nodes.insert(1, "scope", "node")
+    pairs = layer_pair_metrics(present, layer_index, degrees, tresholds)
+    pairs = pairs.melt(id_vars=["treshold", "name"], value_vars=LAYER_PAIR_METRICS, var_name="metric")
+    pairs.insert(1, "scope", "layer_pair")
+    table = pd.concat([nodes, pairs], ignore_index=True)
+    # Layer pairs have no layer
+    table["layer"] = table["layer"].astype("Int64")
+    return table
+
+# Tidy table of every hemisphere, imputation and threshold of a layer combination, in one call.
+# Each matrix (or its edge list when it covers the lowest threshold) is read once for all the thresholds.
+def multilayer_metrics(layers, hemis, imps, tresholds, negative=True):
+    intervals = ee.threshold_intervals(min(tresholds), negative)
+    if dc.layers_folder(layers) in dc.LAYERS_WITHOUT_IMP:
+        # A single matrix per hemisphere, whatever the imputation
+        imps = [None]
+    tables = []
+    for hemi in hemis:
+        for imp in imps:
+            file_path = dc.path("correlation", layers, hemi, imp)
+            if not ms.matrix_exists(file_path):
+                print(f"File does not exist in : {file_path}")
+                continue
+            table = multilayer_table(ee.load_source(file_path, intervals), tresholds, negative)
+            table.insert(0, "imp", imp)
+            table.insert(0, "hemi", hemi)
+            tables.append(table)
+    if not tables:
+        return None
+    return pd.concat(tables, ignore_index=True)
+
+# Multilayer metrics of every hemisphere/imputation of a layer combination
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Intra/inter-layer degrees and strengths, participation and layer-pair densities.")
+    parser.add_argument("--layers", type=int, nargs='+', default=[1, 3], help="[1]=NT, [2]=SD, [3]=CD, or a combination")
+    parser.add_argument("--tresholds", type=float, nargs='+', default=[0.175, 0.229], help="Correlation thresholds")
+    parser.add_argument("--positive-only", action="store_true", help="Ignore negative correlations")
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    dc.start_from_args(args, ["correlation"])
+
+    table = multilayer_metrics(args.layers, ['L', 'R'], [1, 2, 3, 4, 5, 'mean'], args.tresholds,
+                               negative=not args.positive_only)
+    if table is not None:
+        metrics_path = dc.path("multilayer_metrics", args.layers)
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+        table.to_csv(metrics_path, sep=';', index=False)
+        dc.record(metrics_path)
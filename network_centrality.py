@@ -0,0 +1,55 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+# Node metrics computed on every graph, in the order used by the outputs
+NETWORK_ANALYSES = {
+    "betweenness_centrality": nx.betweenness_centrality,
+    "closeness_centrality": nx.closeness_centrality,
+    "degree_centrality": nx.degree_centrality,
+    "clustering_coefficient": nx.clustering
+}
+
+
+# Hash of a correlation matrix content (node names and coefficients)
+def matrix_hash(df):
+    digest = hashlib.sha1()
+    digest.update("\n".join(str(name) for name in df.columns).encode('utf-8'))
+    digest.update(np.ascontiguousarray(df.to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+# Content hash of a graph source: a correlation matrix DataFrame or the sparse edge list of a matrix
+def source_hash(source):
+    if not isinstance(source, dict):
+        return matrix_hash(source)
+    digest = hashlib.sha1()
+    digest.update("\n".join(str(name) for name in source["names"]).encode('utf-8'))
+    for key in ("rows", "cols", "weights"):
+        digest.update(np.ascontiguousarray(source[key]).tobytes())
+    digest.update(repr(source["min_treshold"]).encode('utf-8'))
+    return "edges" + digest.hexdigest()
+
+# Compute every metric of NETWORK_ANALYSES on the graph in one pass, one column per metric.
+# The metrics are topological: edge weights are correlations, not distances.
+def compute_centralities(G):
+    centralities = pd.DataFrame(index=pd.Index(list(G.nodes()), name="Name"))
+    for network_analysis, metric in NETWORK_ANALYSES.items():
+        centralities[network_analysis] = pd.Series(metric(G))
+    return centralities
+
+# Centralities of the graph built from a source (matrix or edge list) at this threshold, read from the
+# cache when the same source content was already analysed. edge_rule describes how the edges were selected
+# (e.g. "positive"), so that graphs built differently from the same matrix do not share an entry.
+def cached_centralities(G, source, treshold, cache_dir, edge_rule="positive"):
+    cache_path = os.path.join(cache_dir, f"{source_hash(source)}_{edge_rule}_{treshold}.csv")
+    if os.path.exists(cache_path):
+        return pd.read_csv(cache_path, delimiter=";", index_col="Name", dtype={"Name": str})
+
+    centralities = compute_centralities(G)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    centralities.to_csv(tmp_path, sep=';')
+    os.replace(tmp_path, cache_path)
+    return centralities
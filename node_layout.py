@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import networkx as nx
+import network_manipulation as nm
+import data_catalog as dc
+
+# Radius of the circle of every layer: [1]=NT, [2]=SD, [3]=CD
+LAYER_SCALES = {1: 2, 2: 3, 3: 1}
+
+# Version of the layout computation, part of the cache key: changing a layout must change it
+LAYOUT_VERSION = 1
+
+# Layouts of this process, by cache key
+_layouts = {}
+
+
+# Cache key of the layout of a node set: the node names, in order, and the layer of every node
+def layout_key(names, node_layers):
+    digest = hashlib.sha1()
+    digest.update(f"layer_rings;v{LAYOUT_VERSION}\n".encode('utf-8'))
+    digest.update("\n".join(f"{name};{layer}" for name, layer in zip(names, node_layers)).encode('utf-8'))
+    return digest.hexdigest()
+
+# Circular layout of the nodes of every layer, with a different radius per layer: {node: (x, y)}
+def layer_rings(names, node_layers):
+    positions = {}
+    for layer in sorted(set(node_layers), key=str):
+        nodes_in_layer = [name for name, node_layer in zip(names, node_layers) if node_layer == layer]
+        circular_pos = nx.circular_layout(nodes_in_layer, scale=LAYER_SCALES.get(layer, 1))
+        for node, (x, y) in circular_pos.items():
+            positions[node] = (float(x), float(y))
+    return positions
+
+# Positions of a node set, computed once and kept in this process and in the layout cache directory,
+# so that every threshold, hemisphere and imputation with the same nodes gets the same layout.
+# node_layers defaults to the layers of network_manipulation.
+def cached_layout(names, node_layers=None, cache_dir=None):
+    names = [str(name) for name in names]
+    if node_layers is None:
+        node_layers = [nm.get_layer(name) for name in names]
+    key = layout_key(names, node_layers)
+    if key in _layouts:
+        return _layouts[key]
+
+    cache_dir = cache_dir or dc.path("layout_cache")
+    cache_path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            positions = {name: tuple(position) for name, position in json.load(f).items()}
+    else:
+        positions = layer_rings(names, node_layers)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(positions, f)
+        os.replace(tmp_path, cache_path)
+    _layouts[key] = positions
+    return positions
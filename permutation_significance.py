@@ -0,0 +1,126 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import correlation_engine as ce
+import matrix_storage as ms
+
+# Default number of permutations and memory budget (bytes) of one batch of permuted correlation matrices
+DEFAULT_PERMUTATIONS = 10000
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+
+# Coefficients are compared with this tolerance, so that permutations giving the observed |r|
+# up to rounding count as at least as extreme
+TOLERANCE = 1e-12
+
+# Decimals of the p-value and q-value CSV files
+SIGNIFICANCE_DECIMALS = 6
+
+
+# Paths of the p-value and q-value matrices stored next to a correlation matrix
+def significance_paths(csv_path):
+    directory, filename = os.path.split(csv_path)
+    return (os.path.join(directory, filename.replace("Spearman_Corr_Matrix", "Spearman_PValue_Matrix")),
+            os.path.join(directory, filename.replace("Spearman_Corr_Matrix", "Spearman_QValue_Matrix")))
+
+# Number of permutations whose matrices fit in the memory budget: each one holds the permuted
+# ranks and their transposed copy (2 x n x p) and the permuted correlation matrix with its absolute value (2 x p x p)
+def batch_size(n_rows, n_columns, memory_budget=DEFAULT_MEMORY_BUDGET):
+    per_permutation = 8 * (2 * n_rows * n_columns + 2 * n_columns * n_columns)
+    return max(1, int(memory_budget // per_permutation))
+
+# Row permutation number index of a run: drawn from its own (seed, index) stream, so the
+# p-values do not depend on the batch size or on how the batches are spread across processes
+def row_permutation(n_rows, seed, index):
+    return np.random.default_rng([seed, index]).permutation(n_rows)
+
+# Count, for every pair, the permutations start..stop whose |r| reaches the observed |r|. All the permutations
+# of the batch are applied to the rows of the standardized ranks at once and correlated with the original
+# ranks in a single matrix multiply: ((B x p) x n) @ (n x p).
+def count_batch(z, observed, seed, start, stop):
+    n_rows, n_columns = z.shape
+    permutations = np.array([row_permutation(n_rows, seed, index) for index in range(start, stop)])
+    permuted = z[permutations].transpose(0, 2, 1).reshape((stop - start) * n_columns, n_rows)
+    null = np.abs(permuted @ z).reshape(stop - start, n_columns, n_columns)
+    return (null >= np.abs(observed) - TOLERANCE).sum(axis=0)
+
+# Run a list of (start, stop) batches and add their counts
+def count_batches(z, observed, seed, batches):
+    counts = np.zeros(observed.shape, dtype=np.int64)
+    for start, stop in batches:
+        counts += count_batch(z, observed, seed, start, stop)
+    return counts
+
+# Permutation counts of the standardized ranks z, the batches bounded by memory_budget
+# and spread over workers processes
+def permutation_counts(z, observed, n_permutations, seed, memory_budget=DEFAULT_MEMORY_BUDGET, workers=1):
+    size = batch_size(*z.shape, memory_budget)
+    batches = [(start, min(start + size, n_permutations)) for start in range(0, n_permutations, size)]
+    if workers == 1 or len(batches) == 1:
+        return count_batches(z, observed, seed, batches)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(count_batches, z, observed, seed, batches[index::workers]) for index in range(workers)]
+        return sum(future.result() for future in futures)
+
+# Two-sided permutation p-values of the Spearman matrix of df: p = (1 + count) / (1 + permutations).
+# With missing values every pair is tested on the rows where both columns are observed, like the
+# pairwise-complete matrix: the columns are grouped by missing values pattern (correlation_engine.missing_patterns)
+# and the rows common to each group of pattern pairs are ranked and permuted once for all their pairs.
+# A pair only depends on its common rows, so a sub-matrix gets the p-values of a separate computation.
+# The counts of the upper triangle are mirrored so that the matrix is symmetric, the diagonal is 0.
+def permutation_pvalues(df, n_permutations=DEFAULT_PERMUTATIONS, seed=0, memory_budget=DEFAULT_MEMORY_BUDGET, workers=1):
+    values = df.to_numpy(dtype=np.float64)
+    groups, shared_rows = ce.missing_patterns(values)
+    n_columns = values.shape[1]
+    counts = np.zeros((n_columns, n_columns), dtype=np.int64)
+    observed = np.full((n_columns, n_columns), np.nan)
+    for rows, pattern_pairs in shared_rows:
+        # Fewer than 2 common rows: no correlation and no p-value
+        if rows.sum() < 2:
+            continue
+        columns, blocks = ce.pattern_columns(groups, pattern_pairs)
+        z = ce.standardized_ranks(values[np.ix_(rows, columns)])
+        block_observed = z.T @ z
+        block_counts = permutation_counts(z, block_observed, n_permutations, seed, memory_budget, workers)
+        for a, b in pattern_pairs:
+            for first, second in [(a, b), (b, a)]:
+                counts[np.ix_(groups[first], groups[second])] = block_counts[blocks[first], blocks[second]]
+                observed[np.ix_(groups[first], groups[second])] = block_observed[blocks[first], blocks[second]]
+
+    upper = np.triu(counts, 1)
+    counts = upper + upper.T
+    pvalues = (counts + 1) / (n_permutations + 1)
+    # Constant columns, and pairs without common rows, have no correlation and no p-value
+    pvalues[np.isnan(observed)] = np.nan
+    np.fill_diagonal(pvalues, 0)
+    return pd.DataFrame(pvalues, index=df.columns, columns=df.columns)
+
+# Benjamini-Hochberg adjusted p-values (q-values) of a symmetric p-value matrix,
+# the family being the pairs of the upper triangle with a p-value. The diagonal is 0.
+def fdr_qvalues(pvalues):
+    values = np.asarray(pvalues, dtype=np.float64)
+    rows, cols = np.triu_indices(values.shape[0], 1)
+    tested = ~np.isnan(values[rows, cols])
+    rows, cols = rows[tested], cols[tested]
+    p = values[rows, cols]
+
+    order = np.argsort(p, kind='stable')
+    ranked = p[order] * len(p) / np.arange(1, len(p) + 1)
+    # Step-up: each q is the minimum of the adjusted values of the larger p-values
+    q = np.empty_like(p)
+    q[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1)
+
+    qvalues = np.full(values.shape, np.nan)
+    qvalues[rows, cols] = q
+    qvalues[cols, rows] = q
+    np.fill_diagonal(qvalues, 0)
+    if isinstance(pvalues, pd.DataFrame):
+        return pd.DataFrame(qvalues, index=pvalues.index, columns=pvalues.columns)
+    return qvalues
+
+# q-value matrix stored next to a correlation matrix, None when it was not computed
+def load_qvalues(csv_path):
+    _, qvalue_path = significance_paths(csv_path)
+    if not ms.matrix_exists(qvalue_path):
+        return None
+    return ms.load_matrix(qvalue_path)
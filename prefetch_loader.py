@@ -0,0 +1,67 @@
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import run_report as rr
+import data_catalog as dc
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# Files read ahead of the computation by default, one thread each
+DEFAULT_PREFETCH = 4
+
+# CSV parsers: "auto" is pyarrow (multi-threaded) when it is installed, the pandas C parser otherwise
+CSV_ENGINES = ["auto", "c", "pyarrow"]
+
+
+# Parser of the semicolon CSV files
+def csv_engine(engine="auto"):
+    if engine == "auto":
+        return "pyarrow" if pyarrow is not None else "c"
+    return engine
+
+# Read a semicolon CSV file with the selected parser, None when it does not exist
+def read_csv(path, engine="auto"):
+    if not dc.exists(path):
+        return None
+    return pd.read_csv(path, delimiter=';', engine=csv_engine(engine))
+
+# Read the CSV files of paths on a bounded thread pool and yield (path, DataFrame) in the order of paths,
+# the DataFrame being None for a missing file. At most prefetch files are read ahead of the consumer,
+# so the reads overlap the computation on the previous files without loading everything at once.
+# The time the consumer waits for a file is reported as a "read_csv" stage.
+def prefetch_csv(paths, prefetch=DEFAULT_PREFETCH, engine="auto"):
+    paths = iter(paths)
+    if prefetch <= 1:
+        for path in paths:
+            with rr.stage("read_csv"):
+                df = read_csv(path, engine)
+            yield path, df
+        return
+
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        pending = deque((path, executor.submit(read_csv, path, engine)) for path in itertools.islice(paths, prefetch))
+        while pending:
+            path, future = pending.popleft()
+            for next_path in itertools.islice(paths, 1):
+                pending.append((next_path, executor.submit(read_csv, next_path, engine)))
+            with rr.stage("read_csv", prefetched=future.done()):
+                df = future.result()
+            yield path, df
+
+# Same as prefetch_csv for jobs reading several files: groups is a list of path tuples,
+# yields the tuple of DataFrames of every group in order
+def prefetch_groups(groups, prefetch=DEFAULT_PREFETCH, engine="auto"):
+    groups = list(groups)
+    frames = prefetch_csv([path for group in groups for path in group], prefetch, engine)
+    for group in groups:
+        yield tuple(df for _, df in itertools.islice(frames, len(group)))
+
+# Command line options of the scripts reading their inputs with the loader
+def add_arguments(parser):
+    parser.add_argument("--prefetch", type=int, default=DEFAULT_PREFETCH,
+                        help="Input files read ahead of the computation on a thread pool (1 = sequential reads)")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="auto",
+                        help="CSV parser of the inputs: auto = pyarrow when installed, the pandas C parser otherwise")
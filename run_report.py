@@ -0,0 +1,227 @@
+import contextlib
+import cProfile
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variables through which worker processes find the report of the run
+REPORT_PATH_VARIABLE = "RUN_REPORT_PATH"
+PROFILE_TOP_VARIABLE = "RUN_REPORT_PROFILE_TOP"
+
+# Report of this process, None when the run is not instrumented
+_report = None
+
+
+# Resident memory of this process (MB): current and peak, None when they cannot be measured.
+# psutil is used when installed, the resource module otherwise (peak only, not on Windows).
+def memory_usage():
+    current = peak = None
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        current = info.rss / 2**20
+        peak = getattr(info, "peak_wset", None)  # Windows only
+        peak = peak / 2**20 if peak is not None else None
+    if peak is None and resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        peak = max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+    return current, peak
+
+# Plain JSON values, numpy scalars and shapes included
+def json_value(value):
+    if hasattr(value, "item") and not isinstance(value, (list, tuple, dict)):
+        return value.item()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+# JSON-lines report of one run: one line per job with its duration, memory and stage timings
+# (CSV read, correlation, graph build, HTML generation, savefig, CSV write...) and a summary line.
+# Worker processes write their own part file next to the report, merged when the run finishes.
+# With profile_top > 0, every job is profiled and the cProfile dumps of the slowest ones are kept.
+class RunReport:
+
+    def __init__(self, report_path, profile_top=0, script=None):
+        self.report_path = report_path
+        self.profile_top = profile_top
+        self.is_main = script is not None
+        self.pid = os.getpid()
+        self.path = report_path if self.is_main else f"{report_path}.{os.getpid()}.part"
+        self.profile_dir = os.path.splitext(report_path)[0] + "_profiles"
+        self.start = time.perf_counter()
+        self.current = None
+        self.profiles = []  # (seconds, path) of the profiles kept by this process
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if self.is_main:
+            self.write({"type": "run", "script": script, "started": datetime.datetime.now().isoformat(timespec='seconds'),
+                        "argv": sys.argv[1:], "pid": os.getpid(), "profile_top": profile_top})
+
+    def write(self, record):
+        self.file.write(json.dumps({key: json_value(value) for key, value in record.items()}, default=str) + "\n")
+        self.file.flush()
+
+    # Time a job, its stages and notes are gathered in a single line
+    @contextlib.contextmanager
+    def job(self, name, **fields):
+        outer = self.current
+        self.current = {"type": "job", "job": name, "pid": os.getpid(), **fields, "stages": []}
+        profiler = cProfile.Profile() if self.profile_top and outer is None else None
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield self.current
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record = self.current
+            record["seconds"] = time.perf_counter() - start
+            record["rss_mb"], record["peak_rss_mb"] = memory_usage()
+            if profiler is not None:
+                self.keep_profile(profiler, record)
+            self.current = outer
+            self.write(record)
+
+    # Time a stage of the current job (or a stage on its own outside of any job)
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        stage = {"stage": name, **fields}
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage["seconds"] = time.perf_counter() - start
+            if self.current is not None:
+                self.current["stages"].append(stage)
+            else:
+                stage["rss_mb"], stage["peak_rss_mb"] = memory_usage()
+                self.write({"type": "stage", "pid": os.getpid(), **stage})
+
+    # Add fields (matrix size, edge count...) to the current job
+    def note(self, **fields):
+        if self.current is not None:
+            self.current.update(fields)
+
+    # Dump the profile of a job when it is among the slowest of this process
+    def keep_profile(self, profiler, record):
+        if len(self.profiles) >= self.profile_top and record["seconds"] <= self.profiles[-1][0]:
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"job_{os.getpid()}_{len(self.profiles)}_{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+        record["profile"] = path
+        self.profiles.append((record["seconds"], path))
+        self.profiles.sort(reverse=True)
+        for _, evicted in self.profiles[self.profile_top:]:
+            os.remove(evicted)
+        self.profiles = self.profiles[:self.profile_top]
+
+    # Merge the parts of the worker processes, keep the profiles of the slowest jobs of the run
+    # and write the summary line
+    def finish(self):
+        for part_path in sorted(glob.glob(f"{glob.escape(self.report_path)}.*.part")):
+            with open(part_path, encoding='utf-8') as f:
+                self.file.write(f.read())
+            os.remove(part_path)
+        self.file.close()
+
+        with open(self.report_path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f]
+        jobs = [record for record in records if record["type"] == "job"]
+        jobs.sort(key=lambda record: record["seconds"], reverse=True)
+        profiled = [record["profile"] for record in jobs if record.get("profile") and os.path.exists(record["profile"])]
+        for path in profiled[self.profile_top:]:
+            os.remove(path)
+        kept = set(profiled[:self.profile_top])
+
+        peaks = [record.get("peak_rss_mb") for record in records if record.get("peak_rss_mb") is not None]
+        summary = {
+            "type": "summary",
+            "jobs": len(jobs),
+            "seconds": time.perf_counter() - self.start,
+            "job_seconds": sum(record["seconds"] for record in jobs),
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "slowest": [{"job": record["job"], "seconds": record["seconds"],
+                         "profile": record.get("profile") if record.get("profile") in kept else None}
+                        for record in jobs[:max(self.profile_top, 5)]]
+        }
+        with open(self.report_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary) + "\n")
+
+
+# Report of this process: the one started by the script, or in a worker process the part of the
+# report announced by the parent through the environment (a forked worker does not reuse the parent's)
+def current():
+    global _report
+    if _report is not None and _report.pid != os.getpid():
+        _report = None
+    if _report is None and os.environ.get(REPORT_PATH_VARIABLE):
+        _report = RunReport(os.environ[REPORT_PATH_VARIABLE], int(os.environ.get(PROFILE_TOP_VARIABLE, 0)))
+    return _report
+
+# Start the report of a run, None when report_path is None (the run is not instrumented).
+# The worker processes started afterwards report to the same run.
+def start(script, report_path=None, profile_top=0):
+    global _report
+    if report_path is None:
+        return None
+    if os.path.exists(report_path):
+        os.remove(report_path)
+    _report = RunReport(report_path, profile_top, script)
+    os.environ[REPORT_PATH_VARIABLE] = report_path
+    os.environ[PROFILE_TOP_VARIABLE] = str(profile_top)
+    return _report
+
+# Finish the report of the run, if any
+def finish():
+    global _report
+    if _report is not None and _report.is_main:
+        _report.finish()
+        _report = None
+        os.environ.pop(REPORT_PATH_VARIABLE, None)
+
+# Context timing a job of the run, does nothing when the run is not instrumented
+def job(name, **fields):
+    report = current()
+    return report.job(name, **fields) if report is not None else contextlib.nullcontext({})
+
+# Context timing a stage of the current job, does nothing when the run is not instrumented
+def stage(name, **fields):
+    report = current()
+    return report.stage(name, **fields) if report is not None else contextlib.nullcontext({})
+
+# Add fields to the current job
+def note(**fields):
+    report = current()
+    if report is not None:
+        report.note(**fields)
+
+# Default report file of a script, in a directory: <dir>/<script>_<time>.jsonl
+def report_path(report_dir, script):
+    return os.path.join(report_dir, f"{script}_{datetime.datetime.now():%Y%m%d_%H%M%S}.jsonl")
+
+# Command line options shared by the instrumented scripts
+def add_arguments(parser):
+    parser.add_argument("--report", default=None,
+                        help="Write a JSON-lines run report (per-job durations, memory, stage timings) in this directory")
+    parser.add_argument("--profile-top", type=int, default=0,
+                        help="With --report, keep the cProfile dumps of the N slowest jobs")
+
+# Start the report of a script from its parsed command line options
+def start_from_args(script, args):
+    if args.report is None:
+        return None
+    return start(script, report_path(args.report, script), args.profile_top)
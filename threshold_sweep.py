@@ -0,0 +1,100 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import matrix_storage as ms
+import edge_extraction as ee
+import data_catalog as dc
+
+
+# Upper-triangle edges of a graph source (correlation matrix DataFrame or edge list) sorted once by decreasing |r|
+# (decreasing r when negative correlations are ignored). NaN coefficients are dropped. With a q-value DataFrame,
+# only the pairs with q <= alpha are kept.
+def sorted_edges(source, negative=True, qvalues=None, alpha=None):
+    rows, cols, weights = ee.source_edges(source, [(-np.inf, np.inf)])
+    if qvalues is not None:
+        significant = ee.aligned_qvalues(qvalues, ee.source_names(source))[rows, cols] <= alpha
+        rows, cols, weights = rows[significant], cols[significant], weights[significant]
+    keys = np.abs(weights) if negative else weights
+    order = np.argsort(-keys, kind='stable')
+    return rows[order], cols[order], weights[order], keys[order]
+
+# Yield (treshold, G) for every threshold in decreasing order, G holding the edges of the graph source with
+# |r| >= treshold (r >= treshold when negative correlations are ignored), like ee.add_source_edges with
+# the threshold intervals. The same graph is grown incrementally: each step only adds the edges between
+# the new and the previous threshold. G is given with the nodes of the source and their attributes.
+def sweep_graphs(G, source, tresholds, negative=True, weight_scale=1, qvalues=None, alpha=None):
+    rows, cols, weights, keys = sorted_edges(source, negative, qvalues, alpha)
+    names = ee.source_names(source)
+    added = 0
+    for treshold in sorted(tresholds, reverse=True):
+        # Number of edges with a key >= treshold (keys are sorted in decreasing order)
+        stop = int(np.searchsorted(-keys, -treshold, side='right'))
+        G.add_edges_from(ee.edge_tuples(names, rows[added:stop], cols[added:stop], weights[added:stop], weight_scale))
+        added = stop
+        yield treshold, G
+
+# Edge count, density and connected components of the graph at every threshold, in one table.
+# Components are tracked with a union-find merged edge by edge, so the whole sweep costs a single pass.
+def sweep_summary(df, tresholds, negative=True):
+    rows, cols, _, keys = sorted_edges(df, negative)
+    n_nodes = df.shape[1]
+    max_edges = n_nodes * (n_nodes - 1) / 2
+    parent = list(range(n_nodes))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    components = n_nodes
+    added = 0
+    summary = []
+    for treshold in sorted(tresholds, reverse=True):
+        stop = int(np.searchsorted(-keys, -treshold, side='right'))
+        for j, k in zip(rows[added:stop].tolist(), cols[added:stop].tolist()):
+            root_j, root_k = find(j), find(k)
+            if root_j != root_k:
+                parent[root_j] = root_k
+                components -= 1
+        added = stop
+        summary.append({
+            "treshold": treshold,
+            "edges": stop,
+            "density": stop / max_edges if max_edges else 0,
+            "components": components
+        })
+    return pd.DataFrame(summary)
+
+# Sweep dense thresholds on every hemisphere/imputation of a layer combination
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize the networks over a dense range of thresholds.")
+    parser.add_argument("--layers", type=int, nargs='+', default=[1, 3], help="[1]=NT, [2]=SD, [3]=CD, or a combination")
+    parser.add_argument("--start", type=float, default=0.1, help="Lowest threshold")
+    parser.add_argument("--stop", type=float, default=0.5, help="Highest threshold")
+    parser.add_argument("--num", type=int, default=50, help="Number of thresholds")
+    parser.add_argument("--positive-only", action="store_true", help="Ignore negative correlations")
+    dc.add_arguments(parser)
+    args = parser.parse_args()
+    dc.start_from_args(args, ["correlation"])
+
+    layers = args.layers
+    tresholds = np.round(np.linspace(args.start, args.stop, args.num), 4).tolist()
+
+    tables = []
+    for hemi in ['L', 'R']:
+        for imp in [1, 2, 3, 4, 5, 'mean']:
+            file_path = dc.path("correlation", layers, hemi, imp)
+            if not ms.matrix_exists(file_path):
+                print(f"File does not exist in : {file_path}")
+                continue
+            summary = sweep_summary(ms.load_matrix(file_path), tresholds, negative=not args.positive_only)
+            summary.insert(0, "imp", imp)
+            summary.insert(0, "hemi", hemi)
+            tables.append(summary)
+
+    if tables:
+        sweep_path = dc.path("threshold_sweep", layers)
+        os.makedirs(os.path.dirname(sweep_path), exist_ok=True)
+        pd.concat(tables, ignore_index=True).to_csv(sweep_path, sep=';', index=False)